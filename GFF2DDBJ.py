@@ -2,15 +2,15 @@
 @author: Maurizio Camagna
 '''
 import sys, os
-from utils.GFFParser import GFFParser
+from utils.GFFParser import GFFParser, UnsortedGFFError
+from utils.GFFIndex import GFFIndex
+from utils.ParseCache import ParseCache
 from utils.DDBJWriter import DDBJWriter
-from utils.FeatureConverter import FeatureConverter
 from utils.FastaParser import FastaParser
+from utils.AssemblyGaps import readAGP
 from utils.Parameters import Parameters
 import argparse
-from utils.features import TruncatedBothSidesFeature, CompoundFeature,\
-    TruncatedFeature
-from utils import GFFWriter
+from utils import GFFWriter, Conversion
 
 def checkFilepaths(filepaths):
     for path in filepaths:
@@ -39,6 +39,13 @@ def main():
     parser.add_argument('--locus_tag_prefix', help="A prefix that is attached before each gene name. Must be 3-12 letters long and contain only alphanumeric characters. The first character should be a letter.")
     parser.add_argument('--export_all', action='store_true', help="Parses the GFF completely, but only writes the source and CDS features. For genome annotations this is typically sufficient and can avoid difficulties such as alternatative splicing, which is not handled well in DDBJ files.")
     parser.add_argument('--gene_as_note', action='store_true', help="By default, the gene name/id will be written as 'gene' qualifier into each feature belonging to that gene. Using this flag, each feature will instead be labeled with 'note gene ID' instead.")
+    parser.add_argument('--legacy_duplicate_ids', action='store_true', help="Duplicate GFF IDs are made unique by attaching a number (ID#1, ID#2, ...). Using this flag, the old naming scheme of attaching 'X' characters (IDX, IDXX, ...) is used instead.")
+    parser.add_argument('--workers', type=int, default=1, help="Optional: Number of worker processes. The features of each contig/chromosome are converted independently, so with more than one worker, the contigs are distributed over multiple processes. The index that lets each worker read its own contigs from the GFF file is stored in the --cache_dir, if given. With --stream, the workers only guess the reading frames of coding sequences that lack start and stop codon.")
+    parser.add_argument('--stream', action='store_true', help="Optional: Converts and writes the GFF file one contig/chromosome at a time, so that only the features of a single contig are kept in memory. Requires a GFF file that is sorted by seqid.")
+    parser.add_argument('--min_gap_length', type=int, default=1, help="Optional: Minimum number of consecutive N's in the FASTA file to be annotated as assembly gap (default: 1).")
+    parser.add_argument('--agp', help="Optional: Path to an AGP file of the assembly. The assembly gaps (including gap type and linkage evidence) are then taken from the AGP file instead of searching the FASTA file for N's.")
+    parser.add_argument('--cache_dir', help="Optional: Directory in which the parsed GFF and FASTA files are cached. Repeated conversions of the same files (i.e. with a different header) can then skip parsing. With --workers, the GFF index is stored here as well.")
+    parser.add_argument('--cache_size', type=int, default=2048, help="Optional: Maximum size of the cache directory in MB. The least recently used entries are removed first (default: 2048).")
     parser.add_argument('--intermediate_gff', help="Optional: Output path for the intermediate GFF file. During parsing of the GFF files, some changes to the information in the GFF file may need to be introduced to allow exporting the file. Writing this intermediate GFF file can be useful to track down sources of error.")
     
     #parser.print_help()
@@ -65,6 +72,8 @@ def main():
     Parameters.export_all = args.export_all
     Parameters.gene_as_note = args.gene_as_note
     Parameters.intermediate_gff = args.intermediate_gff
+    Parameters.legacy_duplicate_ids = args.legacy_duplicate_ids
+    Parameters.min_gap_length = args.min_gap_length
     
     
     if OUTFILE is None:
@@ -73,6 +82,9 @@ def main():
         print("Annotation will be written to:", OUTFILE)
     
     HEADERFILE = args.header
+    AGPFILE = args.agp
+    if AGPFILE is not None:
+        checkFilepaths([AGPFILE])
     if HEADERFILE is None:
         print("Warning: No header file was provided. Make sure to manually add the header after the conversion.")
         checkFilepaths([INFILE, FASTAFILE])
@@ -86,42 +98,94 @@ def main():
     
     ddbjwriter = DDBJWriter(OUTFILE)
     
-    
-    
-    print("Parsing GFF file:", INFILE)
-    gffparser = GFFParser(INFILE)
-    print("Number of features found in GFF file:", len(gffparser.features))
-    features = gffparser.features
-    
-    if Parameters.intermediate_gff is not None:
-        GFFWriter.writeGFF(features)
-    
-    print("Parsing FASTA file")
-    fastaParser = FastaParser(FASTAFILE)
+    cache = None
+    if args.cache_dir is not None:
+        cache = ParseCache(args.cache_dir, args.cache_size)
+    
+    #with multiple workers, each worker parses its own contigs, which requires an index of the GFF file
+    gff_index = None
+    if args.workers > 1 and not args.stream and Parameters.intermediate_gff is None:
+        gff_index = GFFIndex.loadOrBuild(INFILE, args.cache_dir)
+        if gff_index is not None and gff_index.shared_ids:
+            #the IDs must be resolved over the whole file, the workers then only convert the parsed features
+            print("Warning: The GFF file uses the same IDs on several seqids, the whole GFF file is parsed before it is split among the workers.")
+            gff_index = None
+    
+    stream = args.stream
+    if stream:
+        print("Scanning GFF file:", INFILE)
+        try:
+            gff_seqids, shared_ids = GFFParser.scanGFF(INFILE)
+        except UnsortedGFFError as e:
+            print("ERROR:", e, "Sort the GFF file by seqid or run the conversion without --stream.")
+            sys.exit(1)
+        if shared_ids:
+            #the IDs must be resolved over the whole file, which can't be done one contig at a time
+            print("Warning: The GFF file uses the same IDs on several seqids, the whole GFF file is parsed instead of streaming it.")
+            stream = False
+    
+    FastaParser.scoring_workers = args.workers
+    if stream:
+        if args.workers > 1:
+            print("Warning: With --stream, the workers are only used to guess the reading frames of coding sequences.")
+        if Parameters.intermediate_gff is not None:
+            print("Warning: No intermediate GFF file is written when using --stream.")
+    elif gff_index is not None:
+        print("Number of records found in GFF file:", gff_index.getRecordCount())
+        gff_index.applyTraits()
+    else:
+        features = None
+        if cache is not None:
+            features = cache.loadFeatures(INFILE)
+        if features is None:
+            print("Parsing GFF file:", INFILE)
+            features = GFFParser(INFILE).features
+            if cache is not None:
+                cache.storeFeatures(INFILE, features)
+        else:
+            print("Loaded parsed GFF file from cache:", INFILE)
+        print("Number of features found in GFF file:", len(features))
+        
+        if Parameters.intermediate_gff is not None:
+            GFFWriter.writeGFF(features)
+    
+    fastaParser = None
+    if cache is not None:
+        fastaParser = cache.loadFastaParser(FASTAFILE)
+    if fastaParser is None:
+        print("Parsing FASTA file")
+        fastaParser = FastaParser(FASTAFILE, scan_gaps=AGPFILE is None)
+        #without scanning, the parser doesn't know the gaps of the FASTA file and must not be cached
+        if cache is not None and AGPFILE is None:
+            cache.storeFastaParser(FASTAFILE, fastaParser)
+    else:
+        print("Loaded parsed FASTA file from cache:", FASTAFILE)
     fasta_headers = fastaParser.getFastaHeaders()
     
-    if len(fastaParser.assembly_gaps)>0:
+    if AGPFILE is not None:
+        print("Reading assembly gaps from AGP file:", AGPFILE)
+        fastaParser.setAssemblyGaps(readAGP(AGPFILE))
+    elif len(fastaParser.getAssemblyGaps())>0:
         Parameters.askUserForAssemblyGapInfo()
         
     
     print("Converting features")
-    fconverter = FeatureConverter()
-    fconverter.convertFeatures(features)
-    fconverter.addAssemblyGaps(features, fastaParser.assembly_gaps)
-    
-
-    features_to_translate = []
-    for feature in features.values():
-        if isinstance(feature, TruncatedBothSidesFeature) or (isinstance(feature, CompoundFeature) and isinstance(feature.members[0], TruncatedFeature) and isinstance(feature.members[-1], TruncatedFeature) and len(feature.members)>1):
-            features_to_translate.append(feature)
-    if len(features_to_translate)>0:
-        print("Found coding sequences with missing start and stop codon. Guessing best reading frame... this may take a while.")        
-        fastaParser.guessBestReadingFrame(features_to_translate)
-
-    #Remove CDS entries that were flagged with an INVALID_CDS feature while guessing the best reading frame
-    
-    ddbjwriter.writeHeader()
-    ddbjwriter.writeFeatures(features, fasta_headers)
+    if stream:
+        ddbjwriter.writeHeader()
+        Conversion.convertStreaming(INFILE, gff_seqids, fastaParser, ddbjwriter)
+    elif gff_index is not None:
+        formatted_sources = Conversion.convertIndexedInParallel(gff_index, fastaParser, args.workers)
+        ddbjwriter.writeHeader()
+        ddbjwriter.writeFormattedSources(formatted_sources, fasta_headers)
+    elif args.workers > 1:
+        formatted_sources = Conversion.convertInParallel(features, fastaParser, args.workers)
+        ddbjwriter.writeHeader()
+        ddbjwriter.writeFormattedSources(formatted_sources, fasta_headers)
+    else:
+        Conversion.convertFeatures(features, fastaParser)
+        #Remove CDS entries that were flagged with an INVALID_CDS feature while guessing the best reading frame
+        ddbjwriter.writeHeader()
+        ddbjwriter.writeFeatures(features, fasta_headers)
     
     print("Conversion finished...")
     
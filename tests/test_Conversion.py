@@ -0,0 +1,64 @@
+'''
+Tests that the conversion modes (single process, --workers, --stream) produce the same annotation file.
+The tool is run as a script on small generated files. Run from the repository root via: python -m unittest
+'''
+import os, random, subprocess, sys, tempfile, unittest
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEQIDS = ("c1", "c2", "c3")
+
+
+def writeFasta(path):
+    rng = random.Random(1)
+    with open(path, 'wt') as out:
+        for seqid in SEQIDS:
+            seq = "".join(rng.choice("ACGT") for _ in range(600))
+            out.write(">"+seqid+"\n")
+            for i in range(0, len(seq), 60):
+                out.write(seq[i:i+60]+"\n")
+
+
+def writeGFF(path, shared_ids):
+    with open(path, 'wt') as out:
+        for seqid in SEQIDS:
+            prefix = "" if shared_ids else seqid+"_"
+            out.write(f"{seqid}\ttest\tgene\t100\t400\t.\t+\t.\tID={prefix}g1\n")
+            out.write(f"{seqid}\ttest\tmRNA\t100\t400\t.\t+\t.\tID={prefix}g1.t1;Parent={prefix}g1\n")
+            out.write(f"{seqid}\ttest\tCDS\t100\t399\t.\t+\t0\tID={prefix}cds1;Parent={prefix}g1.t1\n")
+
+
+class TestConversionModes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fasta_path = os.path.join(self.tmp_dir.name, "test.fa")
+        writeFasta(self.fasta_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _convert(self, gff_path, name, *args):
+        out_path = os.path.join(self.tmp_dir.name, name+".ann")
+        command = [sys.executable, os.path.join(REPOSITORY, "GFF2DDBJ.py"), "--organism", "Foo bar", "--mol_type", "genomic DNA",
+                   "--locus_tag_prefix", "ABC", "--strain", "S1", "--out", out_path] + list(args) + [gff_path, self.fasta_path]
+        subprocess.run(command, cwd=REPOSITORY, input="1\n1\n1\n", capture_output=True, text=True, check=True)
+        with open(out_path, 'rt') as f:
+            return f.read()
+
+    def _assertModesIdentical(self, shared_ids):
+        gff_path = os.path.join(self.tmp_dir.name, "test.gff3")
+        writeGFF(gff_path, shared_ids)
+        expected = self._convert(gff_path, "single")
+        self.assertEqual(self._convert(gff_path, "workers", "--workers", "3"), expected)
+        self.assertEqual(self._convert(gff_path, "stream", "--stream"), expected)
+
+    def testModes(self):
+        self._assertModesIdentical(shared_ids=False)
+
+    def testModesWithIDsSharedBetweenContigs(self):
+        #the IDs are resolved over the whole file, which merges the three CDS into one
+        self._assertModesIdentical(shared_ids=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
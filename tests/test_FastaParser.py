@@ -0,0 +1,68 @@
+'''
+Tests of the reading frame guessing of the FastaParser. Run from the repository root via: python -m unittest
+'''
+import gzip, os, random, tempfile, unittest
+from utils.Parameters import Parameters
+from utils.features import Feature
+import utils.FastaParser as fasta_module
+from utils.FastaParser import FastaParser
+
+SEQIDS = ("c1", "c2", "c3")
+
+
+def writeFasta(path, opener=open):
+    rng = random.Random(2)
+    with opener(path, 'wt') as out:
+        for seqid in SEQIDS:
+            seq = "".join(rng.choice("ACGT") for _ in range(3000))
+            out.write(">"+seqid+"\n")
+            for i in range(0, len(seq), 60):
+                out.write(seq[i:i+60]+"\n")
+
+
+def createFeatures():
+    rng = random.Random(3)
+    features = []
+    for i in range(30):
+        start = rng.randint(1, 2500)
+        features.append(Feature(SEQIDS[i%3], "test", "CDS", start, start+rng.randint(30, 400), ".", rng.choice("+-"), "0", {"transl_table": "1"}))
+    return features
+
+
+class TestScoringPool(unittest.TestCase):
+
+    def setUp(self):
+        Parameters.init()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.chunk_size = fasta_module.SCORING_CHUNK_SIZE
+        #several chunks, so that the pool is used
+        fasta_module.SCORING_CHUNK_SIZE = 4
+
+    def tearDown(self):
+        fasta_module.SCORING_CHUNK_SIZE = self.chunk_size
+        FastaParser.scoring_workers = 1
+        self.tmp_dir.cleanup()
+
+    def _guess(self, fasta_path, workers):
+        FastaParser.scoring_workers = workers
+        features = createFeatures()
+        FastaParser(fasta_path).guessBestReadingFrame(features)
+        return [(f.attributes["codon_start"], f.attributes.get("INVALID_CDS")) for f in features]
+
+    def _assertPoolMatchesSingleProcess(self, fasta_path):
+        self.assertEqual(self._guess(fasta_path, 3), self._guess(fasta_path, 1))
+
+    def testIndexedFasta(self):
+        fasta_path = os.path.join(self.tmp_dir.name, "test.fa")
+        writeFasta(fasta_path)
+        self._assertPoolMatchesSingleProcess(fasta_path)
+
+    def testScannedFasta(self):
+        #gzip compressed files can't be indexed, their sequences are extracted while reading the file
+        fasta_path = os.path.join(self.tmp_dir.name, "test.fa.gz")
+        writeFasta(fasta_path, gzip.open)
+        self._assertPoolMatchesSingleProcess(fasta_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+'''
+Tests of the ID resolution of the GFFParser. Run from the repository root via: python -m unittest
+'''
+import unittest
+from utils.Parameters import Parameters
+from utils.GFFParser import GFFParser
+
+
+def parseLines(*rows):
+    """Parses GFF lines given as tab separated columns (seqid, type, start, end, attributes)."""
+    lines = []
+    for seqid, gfftype, start, end, attributes in rows:
+        lines.append("\t".join([seqid, "test", gfftype, str(start), str(end), ".", "+", "0", attributes])+"\n")
+    return GFFParser("test.gff3", lines=lines).features
+
+
+class TestUniqueIDs(unittest.TestCase):
+    
+    def setUp(self):
+        Parameters.init()
+    
+    def _parseChildBeforeParent(self):
+        return parseLines(("c1", "CDS", 100, 399, "Parent=g1.t1"),
+                          ("c1", "mRNA", 100, 400, "ID=g1.t1;Parent=g1"),
+                          ("c1", "gene", 100, 400, "ID=g1"))
+    
+    def testChildBeforeParentKeepsParentID(self):
+        features = self._parseChildBeforeParent()
+        self.assertEqual(features["g1.t1"].gfftype, "mRNA")
+        self.assertEqual(features["g1.t1#1"].gfftype, "CDS")
+        self.assertIs(features["g1.t1#1"].parent, features["g1.t1"])
+        self.assertIs(features["g1.t1"].parent, features["g1"])
+    
+    def testChildBeforeParentLegacyIDs(self):
+        Parameters.legacy_duplicate_ids = True
+        features = self._parseChildBeforeParent()
+        self.assertEqual(features["g1.t1"].gfftype, "mRNA")
+        self.assertEqual(features["g1.t1X"].gfftype, "CDS")
+        self.assertIs(features["g1.t1X"].parent, features["g1.t1"])
+    
+    def testDuplicateIDs(self):
+        features = parseLines(("c1", "gene", 100, 400, "ID=g1"),
+                              ("c1", "gene", 1000, 1400, "ID=g1"),
+                              ("c1", "gene", 2000, 2400, "ID=g1"))
+        self.assertEqual([f.start for f in (features["g1"], features["g1#1"], features["g1#2"])], [100, 1000, 2000])
+
+
+if __name__ == "__main__":
+    unittest.main()
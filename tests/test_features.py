@@ -0,0 +1,87 @@
+'''
+Tests of the feature classes. Run from the repository root via: python -m unittest
+'''
+import unittest
+from utils.features import Feature, CompoundFeature
+
+
+def createFeature(start, end, gfftype="CDS", strand="+"):
+    return Feature("c1", "test", gfftype, start, end, ".", strand, "0", {"ID": "f"+str(start)})
+
+
+def createCompound(strand="+"):
+    return CompoundFeature([createFeature(100, 200, strand=strand), createFeature(300, 400, strand=strand), createFeature(500, 600, strand=strand)])
+
+
+class TestStructuralKey(unittest.TestCase):
+
+    def testKeyIsCached(self):
+        feature = createFeature(100, 400)
+        self.assertIs(feature.getStructuralKey(), feature.getStructuralKey())
+
+    def testLocationChangeDropsKey(self):
+        feature = createFeature(100, 400)
+        key = feature.getStructuralKey()
+        feature.end = 500
+        self.assertNotEqual(feature.getStructuralKey(), key)
+        self.assertEqual(feature.getStructuralKey(), createFeature(100, 500).getStructuralKey())
+
+    def testTypeChangeDropsKey(self):
+        feature = createFeature(100, 400)
+        key = feature.getStructuralKey()
+        feature.gfftype = "exon"
+        self.assertNotEqual(feature.getStructuralKey(), key)
+
+    def testAttributeChangeDropsKey(self):
+        feature = createFeature(100, 400)
+        key = feature.getStructuralKey()
+        feature.attributes["product"] = "hypothetical protein"
+        self.assertNotEqual(feature.getStructuralKey(), key)
+        key = feature.getStructuralKey()
+        feature.addAttribute("note", "x")
+        self.assertNotEqual(feature.getStructuralKey(), key)
+
+    def testMemberChangeDropsKey(self):
+        compound = CompoundFeature([createFeature(100, 200), createFeature(300, 400)])
+        key = compound.getStructuralKey()
+        compound.members = compound.members[:1]
+        self.assertNotEqual(compound.getStructuralKey(), key)
+
+
+class TestCompoundSplit(unittest.TestCase):
+
+    def _split(self, gap_start, gap_end, strand="+"):
+        return createCompound(strand).split(gap_start, gap_end)
+
+    def testGapInsideMember(self):
+        left, right = self._split(350, 360)
+        self.assertEqual(left.buildLocationString(), "join(100..200,300..>349)")
+        self.assertEqual(right.buildLocationString(), "join(<361..400,500..600)")
+
+    def testGapStartsAtMemberStart(self):
+        #the left piece of the member at 300..400 is empty, the member before it becomes the truncated end
+        left, right = self._split(300, 350)
+        self.assertEqual(left.buildLocationString(), "100..>200")
+        self.assertEqual((left.start, left.end), (100, 200))
+        self.assertEqual(right.buildLocationString(), "join(<351..400,500..600)")
+
+    def testGapEndsAtMemberEnd(self):
+        left, right = self._split(350, 400, strand="-")
+        self.assertEqual(left.buildLocationString(), "complement(join(100..200,300..>349))")
+        self.assertEqual(right.buildLocationString(), "complement(<500..600)")
+        self.assertEqual((right.start, right.end), (500, 600))
+
+    def testGapCoversMember(self):
+        left, right = self._split(250, 450)
+        self.assertEqual(left.buildLocationString(), "100..>200")
+        self.assertEqual(right.buildLocationString(), "<500..600")
+
+    def testGapAtCompoundStart(self):
+        #nothing remains left of the gap, which FeatureConverter._splitFeaturesWithGaps detects by end < start
+        left, right = self._split(100, 150)
+        self.assertLess(left.end, left.start)
+        self.assertEqual(right.buildLocationString(), "join(<151..200,300..400,500..600)")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,306 @@
+'''
+Detection of assembly gaps (runs of N's) in FASTA files.
+The file is read in large binary blocks instead of line by line, and the sequences are never assembled in memory.
+N runs are found with bytes.translate and bytes.find, which run in C. Gaps may span lines and blocks.
+
+Since the gaps only depend on the FASTA file, the result of a scan is stored next to it (<fasta file>.gaps).
+The first line holds the format version and the size and modification time of the FASTA file, to detect outdated files.
+It is followed by one line per sequence ('>', name, length), each followed by the start and end of its gaps.
+The last line holds the number of sequences and gaps, files without it (i.e. of an interrupted run) are ignored.
+
+Alternatively, the gaps can be read from an AGP file, which also provides the gap type and linkage evidence of each gap.
+'''
+import os
+from array import array
+from utils.BGZFReader import openTextFile
+from utils.FastaIndex import sequenceName
+
+GAP_FILE_VERSION = "3"
+GAP_FILE_SUFFIX = ".gaps"
+GAP_FILE_END = "END"
+
+BLOCK_SIZE = 1<<22
+
+#maps N and n to N and all other bytes to '.', so that the start and end of an N run can be found with bytes.find
+_GAP_MASK = bytes(ord("N") if b in b"Nn" else ord(".") for b in range(256))
+#bytes that are not counted as part of a sequence. Like FastaParser always did, the DDBJ end flags '//' and '\' are ignored
+_NON_SEQUENCE = b"\r\n\\"
+_NON_SEQUENCE_IN_LINE = b"\r\\"
+
+
+class GapList:
+    """The gaps of a single sequence as (start, end) tuples (0-based, end exclusive), stored in two compact arrays.
+    Gaps read from an AGP file also carry their own qualifiers, these are returned as (start, end, qualifiers) tuples."""
+    __slots__ = ("starts", "ends", "qualifiers")
+
+    def __init__(self):
+        self.starts = array('q')
+        self.ends = array('q')
+        self.qualifiers = None
+
+    def addGap(self, start, end, qualifiers=None):
+        if qualifiers is not None and self.qualifiers is None:
+            self.qualifiers = [None]*len(self.starts)
+        self.starts.append(start)
+        self.ends.append(end)
+        if self.qualifiers is not None:
+            self.qualifiers.append(qualifiers)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        if self.qualifiers is not None:
+            return zip(self.starts, self.ends, self.qualifiers)
+        return zip(self.starts, self.ends)
+
+    def __getitem__(self, i):
+        if self.qualifiers is not None:
+            return (self.starts[i], self.ends[i], self.qualifiers[i])
+        return (self.starts[i], self.ends[i])
+
+    def filterByLength(self, min_length):
+        """Returns a GapList with only the gaps of at least min_length bases."""
+        filtered = GapList()
+        for i in range(len(self.starts)):
+            if self.ends[i]-self.starts[i] >= min_length:
+                filtered.addGap(self.starts[i], self.ends[i], None if self.qualifiers is None else self.qualifiers[i])
+        return filtered
+
+
+class GapScanner:
+    """Collects the names, lengths and assembly gaps of all sequences in a FASTA file."""
+
+    def __init__(self):
+        self.headers = []
+        self.seqlens = []
+        self.assembly_gaps = dict() #sequence name -> GapList, only for sequences that contain gaps
+        self.position = 0 #length of the current sequence so far
+        self.gap_start = None #start of an N run that reaches the end of the data scanned so far
+        self.carry = b"" #the incomplete last line of a block, if it contains a '/'
+
+
+    def scan(self, binary_stream):
+        at_line_start = True
+        header = None #a header line that may continue in the next block
+        while True:
+            block = binary_stream.read(BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            pos = 0
+            while pos < len(block):
+                if header is not None:
+                    newline = block.find(b"\n", pos)
+                    if newline == -1:
+                        header += block[pos:]
+                        pos = len(block)
+                        break
+                    header += block[pos:newline]
+                    self._startSequence(header)
+                    header = None
+                    pos = newline+1
+                    at_line_start = True
+                elif at_line_start and block[pos] == ord(">"):
+                    header = bytearray()
+                    pos += 1
+                else:
+                    #everything up to the next header line belongs to the current sequence
+                    next_header = block.find(b"\n>", pos)
+                    end = len(block) if next_header == -1 else next_header+1
+                    self._addSequence(block[pos:end])
+                    at_line_start = block[end-1] == ord("\n")
+                    pos = end
+
+        if header is not None:
+            self._startSequence(header)
+        self._endSequence()
+
+
+    def _startSequence(self, header):
+        self._endSequence()
+        self.headers.append(sequenceName(bytes(header).decode()))
+        self.position = 0
+
+
+    def _endSequence(self):
+        if len(self.headers) == 0 or len(self.seqlens) == len(self.headers):
+            return
+        if len(self.carry) > 0:
+            carry = self.carry
+            self.carry = b""
+            self._scanSequence(self._removeEndFlags(carry))
+        if self.gap_start is not None:
+            self._addGap(self.gap_start, self.position)
+            self.gap_start = None
+        self.seqlens.append(self.position)
+
+
+    def _addGap(self, start, end):
+        gaps = self.assembly_gaps.get(self.headers[-1])
+        if gaps is None:
+            gaps = GapList()
+            self.assembly_gaps[self.headers[-1]] = gaps
+        gaps.addGap(start, end)
+
+
+    def _addSequence(self, data):
+        if len(self.headers) == 0:
+            return
+        if len(self.carry) > 0:
+            data = self.carry + data
+            self.carry = b""
+        
+        if b"/" in data:
+            #'//' is removed per line, so a line that continues in the next block is kept until it is complete
+            last_line = data.rfind(b"\n")+1
+            if last_line < len(data) and b"/" in data[last_line:]:
+                self.carry = data[last_line:]
+                data = data[:last_line]
+            self._scanSequence(self._removeEndFlags(data))
+        else:
+            self._scanSequence(data.translate(None, _NON_SEQUENCE))
+    
+    
+    @staticmethod
+    def _removeEndFlags(data):
+        return b"".join([line.translate(None, _NON_SEQUENCE_IN_LINE).replace(b"//", b"") for line in data.split(b"\n")])
+    
+    
+    def _scanSequence(self, seq):
+        mask = seq.translate(_GAP_MASK)
+
+        i = 0
+        if self.gap_start is not None:
+            #the gap of the previous block may continue
+            i = mask.find(b".")
+            if i == -1:
+                self.position += len(seq)
+                return
+            self._addGap(self.gap_start, self.position+i)
+            self.gap_start = None
+
+        while True:
+            start = mask.find(b"N", i)
+            if start == -1:
+                break
+            end = mask.find(b".", start)
+            if end == -1:
+                self.gap_start = self.position+start
+                break
+            self._addGap(self.position+start, self.position+end)
+            i = end
+        self.position += len(seq)
+
+
+
+def _fingerprint(fasta_path):
+    stat = os.stat(fasta_path)
+    return [str(stat.st_size), str(stat.st_mtime_ns)]
+
+
+def writeGapFile(fasta_path, headers, seqlens, assembly_gaps):
+    """Writes the gap file to a temporary file first, so that an interrupted run never leaves an incomplete gap file behind."""
+    gap_path = fasta_path+GAP_FILE_SUFFIX
+    tmp_path = gap_path+"."+str(os.getpid())
+    try:
+        gap_count = 0
+        with open(tmp_path, 'wt') as out:
+            out.write("\t".join([GAP_FILE_VERSION] + _fingerprint(fasta_path)) + "\n")
+            for header, length in zip(headers, seqlens):
+                out.write(f">\t{header}\t{length}\n")
+                for start, end in assembly_gaps.get(header, ()):
+                    out.write(f"{start}\t{end}\n")
+                    gap_count += 1
+            #the number of sequences and gaps, to detect incomplete files
+            out.write(f"{GAP_FILE_END}\t{len(headers)}\t{gap_count}\n")
+        os.replace(tmp_path, gap_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def readGapFile(fasta_path):
+    """Returns the sequence names, lengths and gaps stored for a FASTA file, or None if there is no up to date and complete gap file."""
+    gap_path = fasta_path+GAP_FILE_SUFFIX
+    if not os.path.exists(gap_path):
+        return None
+    headers = []
+    seqlens = []
+    assembly_gaps = dict()
+    gap_count = 0
+    complete = False
+    with open(gap_path, 'rt') as f:
+        if f.readline().rstrip("\n").split("\t") != [GAP_FILE_VERSION] + _fingerprint(fasta_path):
+            return None
+        gaps = None
+        try:
+            for line in f:
+                spl = line.rstrip("\n").split("\t")
+                if complete:
+                    #nothing may follow the end marker
+                    return None
+                if spl[0] == ">":
+                    headers.append(spl[1])
+                    seqlens.append(int(spl[2]))
+                    gaps = None
+                elif spl[0] == GAP_FILE_END:
+                    complete = int(spl[1]) == len(headers) and int(spl[2]) == gap_count
+                    if not complete:
+                        return None
+                else:
+                    if gaps is None:
+                        gaps = GapList()
+                        assembly_gaps[headers[-1]] = gaps
+                    gaps.addGap(int(spl[0]), int(spl[1]))
+                    gap_count += 1
+        except (ValueError, IndexError):
+            #a malformed gap file is treated like a missing one
+            return None
+    if not complete:
+        return None
+    return headers, seqlens, assembly_gaps
+
+
+
+#AGP gap types and the corresponding DDBJ gap_type. Repeats depend on whether the gap is linked (see readAGP)
+AGP_GAP_TYPES = {"scaffold":"within scaffold", "contig":"between scaffolds", "centromere":"centromere", "short_arm":"short arm",
+                 "heterochromatin":"heterochromatin", "telomere":"telomere", "contamination":"contamination"}
+
+
+def readAGP(agp_path):
+    """Reads the gaps (component type N or U) of an AGP file. Returns a dict mapping each object (the FASTA sequence)
+    to a GapList, in which each gap carries its estimated_length, gap_type and linkage_evidence qualifiers."""
+    assembly_gaps = dict()
+    with openTextFile(agp_path) as f:
+        for line in f:
+            if line.startswith("#") or len(line.strip()) == 0:
+                continue
+            spl = line.rstrip("\r\n").split("\t")
+            if spl[4] != "N" and spl[4] != "U":
+                continue
+            
+            linked = len(spl) > 7 and spl[7] == "yes"
+            if spl[6] == "repeat":
+                gap_type = "repeat within scaffold" if linked else "repeat between scaffolds"
+            else:
+                gap_type = AGP_GAP_TYPES.get(spl[6], "unknown")
+            
+            evidence = []
+            if linked and len(spl) > 8 and spl[8] != "na":
+                evidence = [e.replace("_", " ") for e in spl[8].split(";")]
+            if len(evidence) == 0:
+                #linkage_evidence is mandatory for assembly gaps
+                linkage_evidence = "unspecified"
+            elif len(evidence) == 1:
+                linkage_evidence = evidence[0]
+            else:
+                linkage_evidence = evidence #written as multiple linkage_evidence qualifiers
+            
+            qualifiers = {"estimated_length":"known" if spl[4] == "N" else "unknown", "gap_type":gap_type, "linkage_evidence":linkage_evidence}
+            
+            gaps = assembly_gaps.get(spl[0])
+            if gaps is None:
+                gaps = GapList()
+                assembly_gaps[spl[0]] = gaps
+            gaps.addGap(int(spl[1])-1, int(spl[2]), qualifiers)
+    return assembly_gaps
@@ -0,0 +1,164 @@
+'''
+Reading of (b)gzip compressed input files.
+BGZF files (as written by bgzip) consist of independently compressed blocks of at most 64 kb.
+These blocks can be decompressed in parallel threads, since zlib releases the GIL while decompressing.
+Regular gzip files can only be decompressed sequentially and are read via the gzip module.
+'''
+import gzip, io, os, struct, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+#number of inflate threads of readers that don't specify it. None uses all CPUs, worker processes set it to 1 (see setDefaultThreads)
+_default_threads = None
+
+
+def setDefaultThreads(threads):
+    """Sets the number of inflate threads per reader for this process.
+    Worker processes that run in parallel use a single thread each, instead of one thread per CPU each."""
+    global _default_threads
+    _default_threads = threads
+
+
+def isGzipped(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def isBGZF(path):
+    """Checks whether the file starts with a BGZF block, i.e. a gzip header with the 'BC' extra subfield."""
+    with open(path, 'rb') as f:
+        header = f.read(18)
+    if len(header) < 18 or header[0:2] != GZIP_MAGIC or header[2] != 8 or not (header[3] & 4):
+        return False
+    xlen = struct.unpack("<H", header[10:12])[0]
+    return xlen >= 6 and header[12:14] == b"BC"
+
+
+def openBinaryFile(path):
+    """Opens a plain, gzip or BGZF compressed file for reading its (decompressed) content as bytes."""
+    if isBGZF(path):
+        return io.BufferedReader(BGZFReader(path), buffer_size=1<<20)
+    elif isGzipped(path):
+        return gzip.open(path, 'rb')
+    else:
+        return open(path, 'rb')
+
+
+def openTextFile(path):
+    """Opens a plain, gzip or BGZF compressed text file for reading.
+    Compression is detected from the file content, not from the file extension."""
+    if isBGZF(path):
+        return io.TextIOWrapper(io.BufferedReader(BGZFReader(path), buffer_size=1<<20))
+    elif isGzipped(path):
+        return gzip.open(path, 'rt')
+    else:
+        return open(path, 'rt')
+
+
+def _inflateBlock(cdata, crc, isize):
+    data = zlib.decompress(cdata, -15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise IOError("Corrupted BGZF block (CRC or size mismatch)")
+    return data
+
+
+class BGZFReader(io.RawIOBase):
+    """A readable binary stream over the decompressed content of a BGZF file.
+    Blocks are read sequentially from disk, but decompressed in a thread pool, several blocks ahead of the reader."""
+
+    def __init__(self, path, threads=None):
+        self.path = path
+        self.file_handle = open(path, 'rb')
+        if threads is None:
+            threads = _default_threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.max_pending = threads*4
+        self.pending = deque()
+        self.current = b""
+        self.offset = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def _readBlock(self):
+        """Reads the next compressed block from the file and returns (compressed data, crc, uncompressed size), or None at the end of the file."""
+        header = self.file_handle.read(12)
+        if len(header) == 0:
+            return None
+        if len(header) < 12 or header[0:2] != GZIP_MAGIC:
+            raise IOError("Invalid BGZF block header in "+self.path)
+        xlen = struct.unpack("<H", header[10:12])[0]
+        extra = self.file_handle.read(xlen)
+
+        bsize = None
+        i = 0
+        while i+4 <= len(extra):
+            slen = struct.unpack("<H", extra[i+2:i+4])[0]
+            if extra[i:i+2] == b"BC" and slen == 2:
+                bsize = struct.unpack("<H", extra[i+4:i+6])[0]
+            i += 4+slen
+        if bsize is None:
+            raise IOError("Missing BGZF block size in "+self.path)
+
+        remainder = self.file_handle.read(bsize-xlen-11) #compressed data + CRC32 + ISIZE
+        crc, isize = struct.unpack("<II", remainder[-8:])
+        return remainder[:-8], crc, isize
+
+    def _fillQueue(self):
+        while not self.eof and len(self.pending) < self.max_pending:
+            block_offset = self.file_handle.tell()
+            block = self._readBlock()
+            if block is None:
+                self.eof = True
+                break
+            self.pending.append((block_offset, self.executor.submit(_inflateBlock, *block)))
+
+    def readinto(self, buffer):
+        while self.offset >= len(self.current):
+            self._fillQueue()
+            if len(self.pending) == 0:
+                return 0
+            self.current = self.pending.popleft()[1].result()
+            self.offset = 0
+
+        n = min(len(buffer), len(self.current)-self.offset)
+        buffer[:n] = self.current[self.offset:self.offset+n]
+        self.offset += n
+        return n
+
+    def iterateBlocks(self):
+        """Yields (offset of the compressed block in the file, decompressed data) for all remaining blocks.
+        Can't be mixed with regular reads."""
+        while True:
+            self._fillQueue()
+            if len(self.pending) == 0:
+                return
+            block_offset, future = self.pending.popleft()
+            yield block_offset, future.result()
+    
+    def seekVirtual(self, virtual_offset):
+        """Moves to a BGZF virtual offset, i.e. the offset of the compressed block in the file shifted by 16 bits,
+        combined with the offset within the decompressed block."""
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.eof = False
+        self.file_handle.seek(virtual_offset >> 16)
+        self.current = b""
+        self.offset = 0
+        #the block at the target is inflated right away, the following blocks are only read ahead once they are needed
+        block = self._readBlock()
+        if block is None:
+            self.eof = True
+        else:
+            self.current = _inflateBlock(*block)
+            self.offset = virtual_offset & 0xFFFF
+    
+    def close(self):
+        if not self.closed:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.file_handle.close()
+        super().close()
@@ -0,0 +1,245 @@
+'''
+Runs the conversion of parsed GFF features into DDBJ features, either in a single process,
+split by seqid over several worker processes, or streamed one contig at a time.
+'''
+import contextlib
+import copy
+import io
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from utils.DDBJWriter import DDBJWriter
+from utils.FastaParser import FastaParser
+from utils.FeatureConverter import FeatureConverter
+from utils.FeatureRegistry import FeatureRegistry
+from utils.GFFParser import GFFParser
+from utils.Parameters import Parameters
+from utils.features import TruncatedBothSidesFeature, CompoundFeature, TruncatedFeature
+from utils.FastaIndex import FastaIndex
+from utils import BGZFReader
+
+
+class ConversionReport:
+    """Collects the warnings of a conversion that runs in parts (worker batches or contigs),
+    so that they are printed once for the whole file instead of once per part."""
+    
+    def __init__(self):
+        self.invalid_feature_types = set()
+        self.guessed_reading_frames = 0
+        self.output = [] #everything else the parts printed, in the order of the parts
+    
+    def merge(self, other):
+        self.invalid_feature_types.update(other.invalid_feature_types)
+        self.guessed_reading_frames += other.guessed_reading_frames
+        self.output.extend(other.output)
+    
+    def printWarnings(self):
+        if len(self.invalid_feature_types)>0:
+            print("WARNING: The following invalid feature types will be omitted: ", self.invalid_feature_types)
+        if self.guessed_reading_frames>0:
+            print("Guessed the best reading frame of", self.guessed_reading_frames, "coding sequences with missing start and stop codon.")
+        for output in self.output:
+            sys.stdout.write(output)
+
+
+def convertFeatures(features, fastaParser, report=None):
+    """Converts the features of a GFF feature dict into DDBJ features (in place), adds the assembly gaps
+    and guesses the reading frame of coding sequences that lack both start and stop codon.
+    If a ConversionReport is given, the warnings that would repeat for each part of a conversion are collected in it."""
+    FeatureConverter.checkSeqids({feature.seqid for feature in features.values()})
+    fconverter = FeatureConverter(print_warnings=report is None)
+    fconverter.convertFeatures(features)
+    fconverter.addAssemblyGaps(features, fastaParser.getAssemblyGaps())
+
+    features_to_translate = []
+    for feature in features.values():
+        if isinstance(feature, TruncatedBothSidesFeature) or (isinstance(feature, CompoundFeature) and isinstance(feature.members[0], TruncatedFeature) and isinstance(feature.members[-1], TruncatedFeature) and len(feature.members)>1):
+            features_to_translate.append(feature)
+    if len(features_to_translate)>0:
+        if report is None:
+            print("Found coding sequences with missing start and stop codon. Guessing best reading frame... this may take a while.")
+        fastaParser.guessBestReadingFrame(features_to_translate)
+    if report is not None:
+        report.invalid_feature_types.update(fconverter.invalid_gff_feature_types)
+        report.guessed_reading_frames += len(features_to_translate)
+
+
+def _groupFeaturesBySeqid(features):
+    """Splits the feature dict into one dict per seqid, keeping the original order of the features"""
+    groups = dict()
+    for key, feature in features.items():
+        group = groups.get(feature.seqid)
+        if group is None:
+            group = dict()
+            groups[feature.seqid] = group
+        group[key] = feature
+    return groups
+
+
+def _makeBatches(sizes, fasta_headers, workers):
+    """Distributes the contigs over the workers, given the number of features of each contig. Contigs are assigned largest first
+    to the batch with the fewest features, so that each worker receives a similar amount of work. Each worker only reads the FASTA file once per batch."""
+    batches = [[] for _ in range(workers)]
+    batch_sizes = [0]*workers
+    by_size = sorted(fasta_headers, key=lambda h: sizes.get(h, 0), reverse=True)
+    for header in by_size:
+        i = batch_sizes.index(min(batch_sizes))
+        batches[i].append(header)
+        batch_sizes[i] += sizes.get(header, 0)+1
+    return [b for b in batches if len(b)>0]
+
+
+def _restrictToContigs(fastaParser, headers):
+    """Returns a copy of the FASTA parser that only knows the assembly gaps of the given contigs, and the lengths of these contigs."""
+    seqlens = {header:FastaParser.fasta_dict[header] for header in headers}
+    contig_parser = copy.copy(fastaParser)
+    contig_parser.assembly_gaps = {header:fastaParser.assembly_gaps[header] for header in headers if header in fastaParser.assembly_gaps}
+    return contig_parser, seqlens
+
+
+def _convertAndFormat(features, fastaParser, seqlens, report):
+    """Converts and formats the features of the contigs in seqlens.
+    Returns a dict mapping the seqid to the formatted annotation text of the contig."""
+    features = FeatureRegistry(features)
+    #only create source features for these contigs
+    FastaParser.fasta_dict = seqlens
+    convertFeatures(features, fastaParser, report)
+
+    ddbjwriter = DDBJWriter(None)
+    formatted = dict()
+    for seqid in seqlens.keys():
+        source_feature = features.get(seqid)
+        if source_feature is not None:
+            formatted[seqid] = ddbjwriter.formatSourceFeature(source_feature)
+    return formatted
+
+
+def _runInWorker(function, parameter_state, *args):
+    """Runs a worker function with the parameters of the main process. Returns the result of the function and a
+    ConversionReport, which holds the warnings and the output of the worker, to be printed by the main process."""
+    Parameters.setState(parameter_state)
+    #the workers already run in parallel, so each worker inflates BGZF blocks in a single thread and scores its reading frames itself
+    BGZFReader.setDefaultThreads(1)
+    FastaParser.scoring_workers = 1
+    report = ConversionReport()
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            result = function(*args, report)
+    except BaseException:
+        #i.e. the error message of a missing mandatory qualifier
+        sys.stdout.write(output.getvalue())
+        raise
+    report.output.append(output.getvalue())
+    return result, report
+
+
+def _convertBatch(batch_features, fastaParser, seqlens, report):
+    """Worker function: converts and formats the features of a batch of contigs."""
+    return _convertAndFormat(batch_features, fastaParser, seqlens, report)
+
+
+def _parseAndConvertBatch(gff_index, fastaParser, seqlens, report):
+    """Worker function: parses the features of a batch of contigs via the GFF index, then converts and formats them."""
+    gffparser = GFFParser(gff_index.gff_path, lines=gff_index.readLines(seqlens.keys()))
+    return _convertAndFormat(gffparser.features, fastaParser, seqlens, report)
+
+
+def _prepareFastaIndex(fastaParser):
+    """Builds the FASTA index once in the main process, so that the workers only load it to guess reading frames."""
+    fasta_index = FastaIndex.loadOrBuild(fastaParser.path)
+    if fasta_index is not None:
+        fasta_index.close()
+
+
+def _collectResults(futures):
+    """Returns the formatted contigs of all workers, after printing the warnings of all workers once."""
+    formatted = dict()
+    report = ConversionReport()
+    for future in futures:
+        batch_formatted, batch_report = future.result()
+        formatted.update(batch_formatted)
+        report.merge(batch_report)
+    report.printWarnings()
+    return formatted
+
+
+def convertInParallel(features, fastaParser, workers):
+    """Converts and formats the features in worker processes, with all features of a contig being handled by the same worker.
+    Returns a dict mapping each seqid to its formatted annotation text, which can be written via DDBJWriter.writeFormattedSources"""
+    fasta_headers = fastaParser.getFastaHeaders()
+    groups = _groupFeaturesBySeqid(features)
+    FeatureConverter.checkSeqids(groups.keys())
+    _prepareFastaIndex(fastaParser)
+    parameter_state = Parameters.getState()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        sizes = {seqid:len(group) for seqid, group in groups.items()}
+        for batch in _makeBatches(sizes, fasta_headers, workers):
+            batch_features = dict()
+            for header in batch:
+                batch_features.update(groups.get(header, {}))
+            batch_parser, seqlens = _restrictToContigs(fastaParser, batch)
+            futures.append(executor.submit(_runInWorker, _convertBatch, parameter_state, batch_features, batch_parser, seqlens))
+        return _collectResults(futures)
+
+
+def convertIndexedInParallel(gff_index, fastaParser, workers):
+    """Like convertInParallel, but the GFF file is not parsed beforehand. Each worker only parses the lines of its own contigs,
+    which it finds via the GFF index (see GFFIndex)."""
+    fasta_headers = fastaParser.getFastaHeaders()
+    FeatureConverter.checkSeqids(gff_index.getSeqids())
+    _prepareFastaIndex(fastaParser)
+    sizes = {header:gff_index.getRecordCount(header) for header in fasta_headers}
+    parameter_state = Parameters.getState()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for batch in _makeBatches(sizes, fasta_headers, workers):
+            batch_parser, seqlens = _restrictToContigs(fastaParser, batch)
+            futures.append(executor.submit(_runInWorker, _parseAndConvertBatch, parameter_state, gff_index, batch_parser, seqlens))
+        return _collectResults(futures)
+
+
+def convertStreaming(gff_path, gff_seqids, fastaParser, ddbjwriter):
+    """Parses, converts and writes the features of a GFF file one contig at a time, so that only the features of a single contig
+    are kept in memory. The GFF file must be sorted by seqid (see GFFParser.scanGFF, which also provides gff_seqids).
+    The contigs are written in the order of the FASTA file. Contigs that appear in the GFF file earlier than in the FASTA file
+    are kept as formatted text until it is their turn."""
+    fasta_headers = fastaParser.getFastaHeaders()
+    all_seqlens = FastaParser.fasta_dict
+    gff_seqids = set(gff_seqids)
+    FeatureConverter.checkSeqids(gff_seqids)
+    formatted = dict()
+    next_header = 0
+    report = ConversionReport()
+
+    def convertContig(features, seqid):
+        FastaParser.fasta_dict = all_seqlens
+        contig_parser, seqlens = _restrictToContigs(fastaParser, [seqid])
+        formatted.update(_convertAndFormat(features, contig_parser, seqlens, report))
+
+    def writeReadyContigs():
+        nonlocal next_header
+        ready = []
+        while next_header < len(fasta_headers):
+            header = fasta_headers[next_header]
+            if header not in formatted and header in gff_seqids:
+                break
+            if header not in formatted:
+                #contigs without any GFF features still receive a source feature and their assembly gaps
+                convertContig(dict(), header)
+            ready.append(header)
+            next_header += 1
+        ddbjwriter.writeFormattedSources(formatted, ready)
+        for header in ready:
+            formatted.pop(header, None)
+
+    try:
+        writeReadyContigs()
+        for seqid, lines in GFFParser.iterateContigs(gff_path):
+            convertContig(GFFParser(gff_path, lines=lines).features, seqid)
+            writeReadyContigs()
+    finally:
+        FastaParser.fasta_dict = all_seqlens
+    report.printWarnings()
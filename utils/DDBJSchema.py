@@ -0,0 +1,161 @@
+'''
+The DDBJ feature keys and qualifiers of 'DDBJ_Features.tsv', compiled for fast lookups.
+Each qualifier receives a bit, so that the allowed and mandatory qualifiers of a feature key are bitmasks.
+The spelling variations of feature keys and qualifiers are resolved via alias tables.
+
+The file is located relative to the package (not the working directory) and compiled once per process.
+The compiled schema is also cached on disk (next to the bytecode in utils/__pycache__), so that worker processes don't need to parse the file again.
+The cache is only used if both the file and this module are unchanged.
+'''
+import hashlib, os, pickle
+from types import MappingProxyType
+
+FEATURES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DDBJ_Features.tsv")
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__", "DDBJ_Features.schema.pickle")
+
+_schema = None
+
+
+class DDBJSchema:
+
+    def __init__(self):
+        self.qualifiers = [] #qualifier names, the index is the number of the bit
+        self.qualifier_bits = dict() #qualifier -> bit
+        self.allowed_masks = dict() #feature key -> bitmask of all mandatory and optional qualifiers
+        self.mandatory_masks = dict() #feature key -> bitmask of the mandatory qualifiers
+        self.feature_mappings = dict() #spelling variation -> feature key
+        self.qualifier_mappings = dict() #spelling variation -> qualifier
+
+
+    def _compile(self, features_path):
+        with open(features_path, 'rt') as f:
+            for i, line in enumerate(f):
+                if i==0:
+                    continue
+                s = line.replace("\n", "").split("\t")
+                if s[0] not in self.allowed_masks:
+                    self.allowed_masks[s[0]] = 0
+                    self.mandatory_masks[s[0]] = 0
+                if s[1] != 'M' and s[1] != 'O':
+                    continue
+
+                bit = self.qualifier_bits.get(s[2])
+                if bit is None:
+                    bit = 1 << len(self.qualifiers)
+                    self.qualifiers.append(s[2])
+                    self.qualifier_bits[s[2]] = bit
+                self.allowed_masks[s[0]] |= bit
+                if s[1] == 'M':
+                    self.mandatory_masks[s[0]] |= bit
+
+        self._generateFeatureMappings()
+        self._generateQualifierMappings()
+
+
+    def _generateFeatureMappings(self):
+        """Maps various spelling variations to the correct DDBJ feature key"""
+        self.feature_mappings["cDNA"] = 'mRNA'
+        self.feature_mappings["cdna"] = 'mRNA'
+        self.feature_mappings["CDNA"] = 'mRNA'
+
+        for k in self.allowed_masks.keys():
+            alt_names = set()
+            alt_names.add(k)
+            alt_names.add(k.replace("'", "-"))
+            alt_names.add(k.replace("-", ""))
+            alt_names.add(k.replace("-", "_"))
+            alt_names.add(k.replace("_", "-"))
+            alt_names.add(k.replace("_", ""))
+            alt_names.add(k.replace("3'UTR", "three_prime_UTR"))
+            alt_names.add(k.replace("3", "three"))
+            alt_names.add(k.replace("5'UTR", "five_prime_UTR"))
+            alt_names.add(k.replace("5", "five"))
+
+            for alt_name in alt_names:
+                self.feature_mappings[alt_name] = k
+            for alt_name in alt_names:
+                self.feature_mappings[alt_name.lower()] = k
+
+
+    def _generateQualifierMappings(self):
+        """Maps various spelling variations to the correct DDBJ qualifier"""
+        for qualifier in self.qualifiers:
+            self.qualifier_mappings[qualifier] = qualifier
+            self.qualifier_mappings[qualifier.replace("_", "-")] = qualifier
+            self.qualifier_mappings[qualifier.replace("_", "")] = qualifier
+            self.qualifier_mappings[qualifier.lower()] = qualifier
+            self.qualifier_mappings[qualifier.lower().replace("_", "-")] = qualifier
+            self.qualifier_mappings[qualifier.lower().replace("_", "")] = qualifier
+
+
+    def _freeze(self):
+        self.feature_mappings = MappingProxyType(self.feature_mappings)
+        self.qualifier_mappings = MappingProxyType(self.qualifier_mappings)
+
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["feature_mappings"] = dict(self.feature_mappings)
+        state["qualifier_mappings"] = dict(self.qualifier_mappings)
+        return state
+
+
+    def getMask(self, qualifiers):
+        """Returns the bitmask of the given qualifiers. Unknown qualifiers are ignored."""
+        mask = 0
+        for qualifier in qualifiers:
+            mask |= self.qualifier_bits.get(qualifier, 0)
+        return mask
+
+    def getQualifiers(self, mask):
+        """Returns the set of qualifiers contained in a bitmask."""
+        return {q for i, q in enumerate(self.qualifiers) if mask & (1 << i)}
+
+    def getMandatoryQualifiers(self, feature_key):
+        return self.getQualifiers(self.mandatory_masks[feature_key])
+
+
+
+def _fingerprint(features_path):
+    #the module is hashed as well, since the compiled schema changes with the code that compiles it
+    with open(os.path.abspath(__file__), 'rb') as f:
+        module_hash = hashlib.sha1(f.read()).hexdigest()
+    stat = os.stat(features_path)
+    return (module_hash, stat.st_size, stat.st_mtime_ns)
+
+
+def _loadCache(features_path):
+    try:
+        with open(CACHE_FILE, 'rb') as f:
+            fingerprint, schema = pickle.load(f)
+    except Exception:
+        return None
+    if fingerprint != _fingerprint(features_path):
+        return None
+    return schema
+
+
+def _writeCache(features_path, schema):
+    tmp_path = CACHE_FILE+"."+str(os.getpid())
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(tmp_path, 'wb') as out:
+            pickle.dump((_fingerprint(features_path), schema), out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, CACHE_FILE)
+    except OSError:
+        #the package directory may not be writable, the schema is then compiled by every process
+        pass
+
+
+def getSchema():
+    """Returns the compiled schema of this process. It is loaded from the disk cache, or compiled and cached if the cache is outdated."""
+    global _schema
+    if _schema is None:
+        schema = _loadCache(FEATURES_FILE)
+        if schema is None:
+            schema = DDBJSchema()
+            schema._compile(FEATURES_FILE)
+            _writeCache(FEATURES_FILE, schema)
+        schema._freeze()
+        _schema = schema
+    return _schema
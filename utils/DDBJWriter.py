@@ -62,7 +62,8 @@ class DDBJWriter:
     
     
     
-    def _writeFeature(self, f, isSourceFeature=False):
+    def _formatFeature(self, f, isSourceFeature=False):
+        """Returns the lines of the annotation file representing a single feature"""
         s = ""
         if isSourceFeature:
             s+= f.seqid + '\t'
@@ -86,7 +87,9 @@ class DDBJWriter:
                 s += '\t\t\t'
             value = f.attributes[qualifier]
             if isinstance(value, list): #some qualifiers such as 'note' can occur multiple times
-                for v in value:
+                for j, v in enumerate(value):
+                    if j>0:
+                        s += '\t\t\t'
                     s += qualifier + '\t' + v +'\n'   
             else:
                 s += qualifier + '\t' + value +'\n'
@@ -94,11 +97,33 @@ class DDBJWriter:
             
         if s[-1] != '\n':
             s+="\n"
-            
-        with open(self.outpath, 'at') as out:
-            out.write(s)
-        
+        return s
+    
+    
+    def formatSourceFeature(self, source_feature):
+        """Returns the text for a source feature and all of its children, as it will be written into the annotation file."""
+        if Parameters.sort_features:
+            source_feature.sortChildrenByPosition()
         
+        lines = [self._formatFeature(source_feature, isSourceFeature=True)]
+        for child in source_feature.children:
+            if child.attributes.get("INVALID_CDS") != None: #skip entreis that were flaged as having an invalid CDS
+                print(f"Skipping INVALID CDS {child.attributes}")
+                continue
+            lines.append(self._formatFeature(child))
+        return "".join(lines)
+    
+    
+    def writeFormattedSources(self, formatted_sources, sorted_source_feature_keys):
+        """Writes source features that were already formatted (i.e. by formatSourceFeature in a worker process).
+        formatted_sources maps the source feature keys to their text, the text is written in the order of the sorted keys."""
+        with open(self.outpath, 'at') as out:
+            for sk in sorted_source_feature_keys:
+                s = formatted_sources.get(sk)
+                if s is not None:
+                    out.write(s)
+    
+    
     def writeFeatures(self, features_dict, sorted_source_feature_keys):
         """Writes a all feature to file. The sorted source features must be provided.
         Note: DDBJ appears to insist that the order of contigs/chromosomes must be the same as 
@@ -109,18 +134,10 @@ class DDBJWriter:
         #        source_feature_keys.append(fk)
         source_feature_keys = sorted_source_feature_keys
         
-        for sk in source_feature_keys:
-            source_feature = features_dict.get(sk)
-            if source_feature is None:
-                #print(f"Warning: {sk} does not have a source feature.")
-                continue
-            if Parameters.sort_features:
-                source_feature.sortChildrenByPosition()
-                
-            self._writeFeature(source_feature, isSourceFeature=True)
-            for child in source_feature.children:
-                if child.attributes.get("INVALID_CDS") != None: #skip entreis that were flaged as having an invalid CDS
-                    print(f"Skipping INVALID CDS {child.attributes}")
+        with open(self.outpath, 'at') as out:
+            for sk in source_feature_keys:
+                source_feature = features_dict.get(sk)
+                if source_feature is None:
+                    #print(f"Warning: {sk} does not have a source feature.")
                     continue
-                self._writeFeature(child)
-        
\ No newline at end of file
+                out.write(self.formatSourceFeature(source_feature))
@@ -0,0 +1,206 @@
+'''
+Random access to the sequences of a FASTA file via a samtools compatible index (<fasta file>.fai).
+For BGZF compressed files, the positions of the compressed blocks are stored in an additional index (<fasta file>.gzi).
+Existing indices (i.e. created by 'samtools faidx') are reused, missing or outdated indices are created.
+Regular gzip files can't be indexed, since they can only be decompressed from the start.
+
+Each line of the .fai file describes one sequence: name, length, offset of the first base, bases per line, bytes per line.
+This requires that all lines of a sequence (except for the last one) have the same length.
+
+Uncompressed files are mapped into memory read-only, so that worker processes reading the same file share its pages.
+'''
+import bisect, io, mmap, os, struct
+from utils.BGZFReader import BGZFReader, isBGZF, isGzipped
+
+
+def sequenceName(header):
+    """Returns the name of a sequence, which is its header (without '>') up to the first whitespace, like in samtools faidx."""
+    spl = header.split(None, 1)
+    return spl[0] if len(spl) > 0 else ""
+
+
+class FastaIndex:
+
+    def __init__(self, fasta_path, bgzf):
+        self.fasta_path = fasta_path
+        self.bgzf = bgzf
+        self.entries = dict() #name -> (length, offset, bases per line, bytes per line)
+        self.block_starts = [] #BGZF only: (uncompressed offset, compressed offset) of each block
+        self.file_handle = None
+        self.file_map = None #uncompressed files only
+
+
+    @staticmethod
+    def loadOrBuild(fasta_path):
+        """Returns the index of a FASTA file, or None if the file can't be indexed
+        (gzip compressed files that are not BGZF compressed, or lines of irregular length)."""
+        bgzf = isBGZF(fasta_path)
+        if not bgzf and isGzipped(fasta_path):
+            return None
+
+        index = FastaIndex(fasta_path, bgzf)
+        if index._load():
+            return index
+        if not index._build():
+            return None
+        try:
+            index._write()
+        except OSError:
+            print("Warning: Could not write the FASTA index to", fasta_path+".fai")
+        return index
+
+
+    def _isCurrent(self, index_path):
+        return os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(self.fasta_path)
+
+
+    def _load(self):
+        if not self._isCurrent(self.fasta_path+".fai"):
+            return False
+        if self.bgzf and not self._isCurrent(self.fasta_path+".gzi"):
+            return False
+
+        with open(self.fasta_path+".fai", 'rt') as f:
+            for line in f:
+                spl = line.rstrip("\n").split("\t")
+                self.entries[spl[0]] = (int(spl[1]), int(spl[2]), int(spl[3]), int(spl[4]))
+        if self.bgzf:
+            with open(self.fasta_path+".gzi", 'rb') as f:
+                count = struct.unpack("<Q", f.read(8))[0]
+                self.block_starts = [(0, 0)]
+                for _ in range(count):
+                    compressed, uncompressed = struct.unpack("<QQ", f.read(16))
+                    self.block_starts.append((uncompressed, compressed))
+        return True
+
+
+    def _write(self):
+        with open(self.fasta_path+".fai", 'wt') as out:
+            for name, (length, offset, linebases, linewidth) in self.entries.items():
+                out.write(f"{name}\t{length}\t{offset}\t{linebases}\t{linewidth}\n")
+        if self.bgzf:
+            #like samtools, the first block (which always starts at 0) is not written
+            with open(self.fasta_path+".gzi", 'wb') as out:
+                out.write(struct.pack("<Q", len(self.block_starts)-1))
+                for uncompressed, compressed in self.block_starts[1:]:
+                    out.write(struct.pack("<QQ", compressed, uncompressed))
+
+
+    def _iterateLines(self):
+        """Yields the lines of the (decompressed) file as bytes. For BGZF files, the block positions are collected along the way."""
+        if not self.bgzf:
+            with open(self.fasta_path, 'rb') as f:
+                yield from f
+            return
+
+        reader = BGZFReader(self.fasta_path)
+        uncompressed = 0
+        partial = b""
+        for block_offset, data in reader.iterateBlocks():
+            if len(data) > 0:
+                self.block_starts.append((uncompressed, block_offset))
+            uncompressed += len(data)
+            lines = (partial+data).split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                yield line+b"\n"
+        if len(partial) > 0:
+            yield partial
+        reader.close()
+
+
+    def _build(self):
+        """Collects the information of the .fai file. Returns False if the lines of a sequence are of irregular length."""
+        print("Building FASTA index:", self.fasta_path+".fai")
+        name = None
+        offset = 0
+        for line in self._iterateLines():
+            if line.startswith(b">"):
+                name = sequenceName(line[1:].decode())
+                if name in self.entries:
+                    print("Warning: The FASTA file contains", name, "more than once and can't be indexed.")
+                    return False
+                entry = [0, offset+len(line), 0, 0, False] #length, offset, bases per line, bytes per line, last line reached
+                self.entries[name] = entry
+            elif name is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if b"/" in line or b"\\" in line:
+                    #i.e. the DDBJ end flag '//', which is not part of the sequence
+                    print("Warning: The FASTA file contains lines that are not part of a sequence and can't be indexed.")
+                    return False
+                if bases > 0:
+                    if entry[4] or (entry[2] > 0 and bases > entry[2]):
+                        #only the last line of a sequence may be shorter
+                        print("Warning: The lines of", name, "are of irregular length, the FASTA file can't be indexed.")
+                        return False
+                    if entry[2] == 0:
+                        entry[2] = bases
+                        entry[3] = len(line)
+                    elif bases < entry[2] or len(line) != entry[3]:
+                        entry[4] = True
+                    entry[0] += bases
+                else:
+                    entry[4] = True
+            offset += len(line)
+
+        self.entries = {name:tuple(entry[0:4]) for name, entry in self.entries.items()}
+        return True
+
+
+    def getLengths(self):
+        """Returns a dict mapping the sequence names to their lengths."""
+        return {name:entry[0] for name, entry in self.entries.items()}
+
+    def hasSequence(self, name):
+        return name in self.entries
+
+
+    def _readAt(self, offset, size):
+        if self.file_handle is None:
+            if self.bgzf:
+                self.file_handle = BGZFReader(self.fasta_path, threads=1)
+            else:
+                self.file_handle = io.FileIO(self.fasta_path, 'r')
+                if os.path.getsize(self.fasta_path) > 0:
+                    self.file_map = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        if self.file_map is not None:
+            return self.file_map[offset:offset+size]
+
+        if self.bgzf:
+            i = bisect.bisect_right(self.block_starts, (offset, float("inf")))-1
+            uncompressed, compressed = self.block_starts[i]
+            self.file_handle.seekVirtual((compressed << 16) | (offset-uncompressed))
+        else:
+            self.file_handle.seek(offset)
+
+        chunks = []
+        while size > 0:
+            chunk = self.file_handle.read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+
+    def fetch(self, name, start, end):
+        """Returns the bases start..end (1-based, inclusive) of a sequence, like genomeseq[start-1:end] would."""
+        length, offset, linebases, linewidth = self.entries[name]
+        start = max(start-1, 0)
+        end = min(end, length)
+        if start >= end:
+            return ""
+        first = offset + (start//linebases)*linewidth + start%linebases
+        last = offset + ((end-1)//linebases)*linewidth + (end-1)%linebases
+        data = self._readAt(first, last-first+1)
+        return data.replace(b"\n", b"").replace(b"\r", b"").decode()
+
+
+    def close(self):
+        if self.file_map is not None:
+            self.file_map.close()
+            self.file_map = None
+        if self.file_handle is not None:
+            self.file_handle.close()
+            self.file_handle = None
@@ -1,67 +1,70 @@
-import re, gzip
+import re
+from concurrent.futures import ProcessPoolExecutor
 from utils.features import CompoundFeature
+from utils.BGZFReader import openTextFile, openBinaryFile
+from utils.AssemblyGaps import GapScanner, readGapFile, writeGapFile
+from utils.Parameters import Parameters
+from utils.FastaIndex import FastaIndex, sequenceName
+from utils import Translation
+
+#complement of each base, including the IUPAC ambiguity codes. Other characters are kept as they are
+COMPLEMENT_TABLE = bytes.maketrans(b"ACGTUMRWSYKVHDBN", b"TGCAAKYWSRMBDHVN")
+#overlapping matches, so that the stop codons of all three frames are found at once
+STOP_CODON_PATTERN = re.compile("(?=TGA|TAA|TAG)")
+#number of features whose reading frames are scored by a worker process at once
+SCORING_CHUNK_SIZE = 2000
 
 class FastaParser:
     
-    def __init__(self, fasta_file_path):
+    #number of processes that score the reading frames (see guessBestReadingFrame), set from --workers.
+    #Processes that already run in parallel (see Conversion._runInWorker) score their features themselves
+    scoring_workers = 1
+    
+    def __init__(self, fasta_file_path, scan_gaps=True):
         self.path = fasta_file_path
-        self.gap_regex = re.compile("(N|n)+")
         self.assembly_gaps = dict()
-        self.parseFile()
-    
-    def findGaps(self, fasta_entry_name, seq):    
-        gap_list = None
-        for gap in self.gap_regex.finditer(seq):
-            if gap_list is None: #this is to assure that we only fetch the list once for performance reasons
-                gap_list = self.assembly_gaps.get(fasta_entry_name)
-                if gap_list is None:
-                    gap_list = []
-                    self.assembly_gaps[fasta_entry_name] = gap_list
-            gap_list.append((gap.start(), gap.end()))
+        #if the gaps are provided otherwise (i.e. by an AGP file), the sequence lengths may be available without reading the sequences
+        if scan_gaps or not self._readSequenceLengths():
+            self.parseFile()
     
         
     def parseFile(self):
-        inp = None
-        if self.path.lower().endswith("gz") or self.path.lower().endswith("gzip"):
-            inp = gzip.open(self.path, 'rt')
+        """Obtains the names and lengths of all sequences, as well as the assembly gaps (N's) within them.
+        The result is stored in a gap file next to the FASTA file, so that later runs don't need to read the sequences again."""
+        stored = readGapFile(self.path)
+        if stored is not None:
+            self.headers, self.seqlens, self.assembly_gaps = stored
         else:
-            inp = open(self.path, 'rt')
-            
-        self.headers = []
-        self.seqlens = []
-        
-        current_seq_len = 0
-        current_lines = []
-        
-        for i, line in enumerate(inp):
-            if line[-1] == '\n':
-                line = line[:-1]
-            
-            if line.startswith(">"):
-                line = line[1:].split(" ")[0]
-                
-                if i>0:
-                    current_seq = "".join(current_lines)
-                    current_lines.clear()
-                    self.findGaps(self.headers[-1], current_seq)
-                    current_seq = None
-                    self.seqlens.append(current_seq_len)
-                current_seq_len = 0
-                self.headers.append(line)
-                
-            else:
-                line = line.replace('\\', '').replace('//','') #to ignore the completely unnecessary DDBJ fasta 'end flag'
-                current_seq_len+= len(line)
-                current_lines.append(line)
+            scanner = GapScanner()
+            with openBinaryFile(self.path) as inp:
+                scanner.scan(inp)
             
-        #Last fasta entry needs to be added        
-        current_seq = "".join(current_lines)
-        current_lines.clear()
-        self.findGaps(self.headers[-1], current_seq)
-        current_seq = None
-        self.seqlens.append(current_seq_len)
-        inp.close()
-        
+            self.headers = scanner.headers
+            self.seqlens = scanner.seqlens
+            self.assembly_gaps = scanner.assembly_gaps
+            try:
+                writeGapFile(self.path, self.headers, self.seqlens, self.assembly_gaps)
+            except OSError:
+                print("Warning: Could not store the assembly gaps next to the FASTA file.")
+        self.registerSequenceLengths()
+    
+    def _readSequenceLengths(self):
+        """Obtains only the names and lengths of the sequences from the gap file or the FASTA index. Returns False if neither is available."""
+        stored = readGapFile(self.path)
+        if stored is not None:
+            self.headers, self.seqlens, _ = stored
+        else:
+            fasta_index = FastaIndex.loadOrBuild(self.path)
+            if fasta_index is None:
+                return False
+            lengths = fasta_index.getLengths()
+            self.headers = list(lengths.keys())
+            self.seqlens = list(lengths.values())
+        self.registerSequenceLengths()
+        return True
+    
+    def registerSequenceLengths(self):
+        """Makes the sequence lengths available via FastaParser.fasta_dict"""
         FastaParser.fasta_dict = dict()
         for h, length in zip(self.headers, self.seqlens):
             FastaParser.fasta_dict[h] = length
@@ -69,101 +72,203 @@ class FastaParser:
     def getFastaHeaders(self):
         return self.headers
     
+    def setAssemblyGaps(self, assembly_gaps):
+        """Replaces the gaps found in the FASTA file, i.e. by the gaps listed in an AGP file"""
+        self.assembly_gaps = dict()
+        for header, gap_list in assembly_gaps.items():
+            if header not in FastaParser.fasta_dict:
+                print("Warning: Ignoring the assembly gaps of", header, "which is not present in the FASTA file.")
+                continue
+            self.assembly_gaps[header] = gap_list
     
+    def getAssemblyGaps(self):
+        """Returns the assembly gaps of each sequence that are at least Parameters.min_gap_length long.
+        Sequences without such gaps are omitted."""
+        if Parameters.min_gap_length <= 1:
+            return self.assembly_gaps
+        gaps = dict()
+        for header, gap_list in self.assembly_gaps.items():
+            filtered = gap_list.filterByLength(Parameters.min_gap_length)
+            if len(filtered) > 0:
+                gaps[header] = filtered
+        return gaps
     
     
-    def reverseComplement(self, sequence):
-        sequence = sequence.upper()
-        rc = ""
-        for s in reversed(sequence):
-            if s=="A":
-                rc+="T"
-            elif s == "T":
-                rc+= "A"
-            elif s == "C":
-                rc+= "G"
-            elif s == "G":
-                rc+= "C"
-        return rc
+    
+    
+    @staticmethod
+    def reverseComplement(sequence):
+        return sequence.upper().encode("ascii").translate(COMPLEMENT_TABLE)[::-1].decode("ascii")
     
     def extractSequence(self, feature, genomeseq):
-        extracted = ""
         if isinstance(feature, CompoundFeature):
-            for m in feature.members:
-                extracted += genomeseq[m.start-1: m.end] #python starts position at 0
+            extracted = "".join([genomeseq[m.start-1: m.end] for m in feature.members]) #python starts position at 0
         else:
-            extracted += genomeseq[feature.start-1 : feature.end]
-        
+            extracted = genomeseq[feature.start-1 : feature.end]
+        return FastaParser._orientSequence(feature.strand, extracted)
+    
+    def fetchSequence(self, feature, fasta_index):
+        """Like extractSequence, but only the required parts of the sequence are read via the FASTA index"""
+        return FastaParser.fetchLocation(FastaParser.getLocation(feature), fasta_index)
+    
+    @staticmethod
+    def getLocation(feature):
+        """Returns the seqid, the strand and the (start, end) parts of a feature, i.e. to send it to a worker process without its hierarchy."""
+        members = feature.members if isinstance(feature, CompoundFeature) else [feature]
+        return feature.seqid, feature.strand, [(m.start, m.end) for m in members]
+    
+    @staticmethod
+    def fetchLocation(location, fasta_index):
+        seqid, strand, parts = location
+        extracted = "".join([fasta_index.fetch(seqid, start, end) for start, end in parts])
+        return FastaParser._orientSequence(strand, extracted)
+    
+    @staticmethod
+    def _orientSequence(strand, extracted):
         extracted = extracted.upper()
        
-        if feature.strand == "-":
-            extracted = self.reverseComplement(extracted)
+        if strand == "-":
+            extracted = FastaParser.reverseComplement(extracted)
             
         return extracted
     
     def evaluateReadingFrames(self, cds_seq):
+        return self.evaluateReadingFramesBatch([cds_seq])[0]
+    
+    @staticmethod
+    def evaluateReadingFramesBatch(cds_sequences):
+        """Returns the best reading frame (0, 1 or 2) of each sequence, i.e. the frame with the fewest stop codons.
+        The sequences are joined and searched for stop codons only once, each stop codon is assigned to the frame given by its position.
+        Like always, the last complete codon of a frame is not counted and ties are resolved in favor of the later frame."""
+        starts = []
+        ends = []
+        pos = 0
+        for cds_seq in cds_sequences:
+            starts.append(pos)
+            ends.append(pos+len(cds_seq))
+            pos += len(cds_seq)+1
+        stopcodons = [[0, 0, 0] for _ in cds_sequences]
         
-        pattern = re.compile("TGA|TAA|TAG")
-        best_frame = -1
-        best_stopcodons = 999
+        joined = "|".join(cds_sequences) #the separator prevents matches spanning two sequences
+        i = 0
+        for match in STOP_CODON_PATTERN.finditer(joined):
+            p = match.start()
+            while p >= ends[i]:
+                i += 1
+            if p+3 < ends[i]:
+                stopcodons[i][(p-starts[i])%3] += 1
         
-        for frame in [0,1,2]:
-            current_stopcodons = 0
-            orf = cds_seq[frame:]
-            x = 0
-            while x<len(orf)-3:
-                codon = orf[x:x+3]
-                if len(pattern.findall(codon))>0:
-                    current_stopcodons+=1
-                x+=3
-            
-            if current_stopcodons<= best_stopcodons:
-                best_stopcodons = current_stopcodons
-                best_frame = frame
-                
-        return best_frame
+        best_frames = []
+        for counts in stopcodons:
+            best_frame = -1
+            best_stopcodons = 999
+            for frame in [0,1,2]:
+                if counts[frame] <= best_stopcodons:
+                    best_stopcodons = counts[frame]
+                    best_frame = frame
+            best_frames.append(best_frame)
+        return best_frames
         
         
-    def translate_sequence(self, dna_seq):
-        codontab = {
-                    'TCA': 'S','TCC': 'S','TCG': 'S','TCT': 'S','TTC': 'F','TTT': 'F','TTA': 'L','TTG': 'L','TAC': 'Y', 'TAT': 'Y', 'TAA': '*', 'TAG': '*', 'TGC': 'C',
-                    'TGT': 'C','TGA': '*','TGG': 'W','CTA': 'L','CTC': 'L','CTG': 'L','CTT': 'L','CCA': 'P','CCC': 'P','CCG': 'P','CCT': 'P','CAC': 'H','CAT': 'H','CAA': 'Q','CAG': 'Q','CGA': 'R',
-                    'CGC': 'R','CGG': 'R','CGT': 'R','ATA': 'I','ATC': 'I','ATT': 'I','ATG': 'M','ACA': 'T','ACC': 'T','ACG': 'T','ACT': 'T','AAC': 'N','AAT': 'N','AAA': 'K','AAG': 'K','AGC': 'S',
-                    'AGT': 'S','AGA': 'R','AGG': 'R','GTA': 'V','GTC': 'V','GTG': 'V','GTT': 'V','GCA': 'A','GCC': 'A','GCG': 'A','GCT': 'A','GAC': 'D','GAT': 'D','GAA': 'E','GAG': 'E','GGA': 'G',
-                    'GGC': 'G','GGG': 'G','GGT': 'G' }
-                    
-        prot_seq = ""
-        for i in range(0, len(dna_seq)-2, 3):
-            codon = dna_seq[i]+ dna_seq[i+1]+dna_seq[i+2]
-            aa = codontab.get(codon.upper())
-            if aa is None:
-                print(f"WARNING: Could not translate codon {codon}.")
-            else:
-                prot_seq += aa
-        print(prot_seq)
-        return prot_seq
+    def translate_sequence(self, dna_seq, transl_table=1):
+        return Translation.translate(dna_seq, transl_table)
 
 
+    @staticmethod
+    def scoreSequences(sequences, transl_tables):
+        """Returns the best reading frame of each sequence and whether its translation contains a stop codon.
+        Only needs the sequences, so that it can run in a worker process."""
+        best_frames = FastaParser.evaluateReadingFramesBatch(sequences)
+        proteins = Translation.translateBatch(sequences, transl_tables)
+        return [(best_frame, "*" in prot_seq) for best_frame, prot_seq in zip(best_frames, proteins)]
+    
+    def _assignReadingFrames(self, features, sequences):
+        transl_tables = [self._getTranslTable(feature) for feature in features]
+        self._assignScores(features, FastaParser.scoreSequences(sequences, transl_tables))
+    
+    def _assignScores(self, features, scores):
+        for feature, (best_frame, has_stop_codon) in zip(features, scores):
+            self._assignReadingFrame(feature, best_frame, has_stop_codon)
+    
+    @staticmethod
+    def _getTranslTable(feature):
+        transl_table = feature.attributes.get("transl_table", "1")
+        try:
+            Translation.getCodonTable(transl_table)
+        except ValueError:
+            print("Warning: Unknown transl_table", transl_table, "- the standard genetic code is used to check", feature.attributes)
+            transl_table = 1
+        return transl_table
+    
+    def _assignReadingFrame(self, feature, best_frame, has_stop_codon):
+        feature.attributes["codon_start"] = str(best_frame+1)
+        #TODO: Check if contains stop codon and adjust CDS range otherwise
+        if has_stop_codon:
+            print("WARNING: Found stop codon within translated CDS sequence.")
+            feature.attributes['INVALID_CDS'] = "INVALID_CDS"
+    
+    
     def guessBestReadingFrame(self, ddbj_features):
         """For features where both start and end positions are unkown, we need to obtain
         the DNA sequence, and check all three codon offsets for whether we get stop codons within
-        the sequence"""
-        
-        fasta_headers_of_interest = set()
+        the sequence. The sequences are read via the FASTA index if the file can be indexed.
+        If FastaParser.scoring_workers is larger than 1, the features are scored in a pool of worker processes (see _usesScoringPool).
+        Each worker maps the FASTA file itself, so that the genome is shared through the page cache instead of being sent to the workers."""
+        features_by_seqid = dict()
         for feature in ddbj_features:
-            fasta_headers_of_interest.add(feature.seqid)
+            features_by_seqid.setdefault(feature.seqid, []).append(feature)
         
-        inp = None
-        if self.path.lower().endswith("gz") or self.path.lower().endswith("gzip"):
-            
-            inp = gzip.open(self.path, 'rt')
-        else:
-            inp = open(self.path, 'rt')
+        fasta_index = FastaIndex.loadOrBuild(self.path)
+        if fasta_index is None:
+            self._guessBestReadingFrameByScanning(features_by_seqid)
+            return
+        
+        try:
+            #the contigs are visited in the order of the FASTA file
+            contig_features = [features_by_seqid[seqid] for seqid in self.headers if seqid in features_by_seqid and fasta_index.hasSequence(seqid)]
+            if self._usesScoringPool(contig_features):
+                self._guessBestReadingFrameInPool([feature for features in contig_features for feature in features])
+                return
+            for features in contig_features:
+                self._assignReadingFrames(features, [self.fetchSequence(feature, fasta_index) for feature in features])
+        finally:
+            fasta_index.close()
+    
+    @staticmethod
+    def _usesScoringPool(contig_features):
+        """A pool is only started if there is more than a single chunk of features to score."""
+        return FastaParser.scoring_workers > 1 and sum([len(features) for features in contig_features]) > SCORING_CHUNK_SIZE
+    
+    def _guessBestReadingFrameInPool(self, features):
+        """Scores chunks of features in worker processes, which read the sequences from their own FASTA index (see _openScoringIndex)."""
+        chunks = [features[i:i+SCORING_CHUNK_SIZE] for i in range(0, len(features), SCORING_CHUNK_SIZE)]
+        with ProcessPoolExecutor(max_workers=FastaParser.scoring_workers, initializer=_openScoringIndex, initargs=(self.path,)) as executor:
+            futures = []
+            for chunk in chunks:
+                locations = [FastaParser.getLocation(feature) for feature in chunk]
+                futures.append(executor.submit(_scoreLocations, locations, [self._getTranslTable(feature) for feature in chunk]))
+            for chunk, future in zip(chunks, futures):
+                self._assignScores(chunk, future.result())
+    
+    
+    def _guessBestReadingFrameByScanning(self, features_by_seqid):
+        """Reads the whole FASTA file to obtain the sequences, i.e. for gzip compressed files.
+        With a scoring pool, the sequences of the features are extracted here and scored in the workers while the next contig is read."""
+        #the remainder of the file can be skipped once all sequences of interest were processed
+        remaining_headers = set(features_by_seqid.keys())
+        executor = None
+        if self._usesScoringPool(features_by_seqid.values()):
+            executor = ProcessPoolExecutor(max_workers=FastaParser.scoring_workers)
+        pending = [] #(features, future) of the chunks that are scored by the pool
+        
+        inp = openTextFile(self.path)
         
         currentHeader = ""
-        currentSeq = ""
+        currentSeq = []
         foundSequenceOfInterest = False
         for line in inp:
+            if not foundSequenceOfInterest and not line.startswith(">"):
+                continue
             if line.startswith("\\\\") or line.startswith('//'):
                 continue
             
@@ -173,29 +278,51 @@ class FastaParser:
             
             if line.startswith(">"):
                 if foundSequenceOfInterest:#if the current sequence needs to be parsed
-                    for i, feature in enumerate(ddbj_features):
-                        if feature.seqid == currentHeader:
-                            extracted = self.extractSequence(feature, currentSeq)
-                            best_frame = self.evaluateReadingFrames(extracted)
-                            feature.attributes["codon_start"] = str(best_frame+1)
-                            #TODO: Check if contains stop codon and adjust CDS range otherwise
-                            print(feature.attributes)
-                            #print(extracted)
-                            prot_seq = self.translate_sequence(extracted) 
-                            print(prot_seq)
-                            #if "*" in prot_seq[:-1]:
-                            if "*" in prot_seq:
-                                print("WARNING: Found stop codon within translated CDS sequence.")
-                                feature.attributes['INVALID_CDS'] = "INVALID_CDS"
+                    self._assignReadingFramesOfContig(features_by_seqid[currentHeader], "".join(currentSeq), executor, pending)
+                    remaining_headers.discard(currentHeader)
+                    if len(remaining_headers) == 0:
+                        foundSequenceOfInterest = False
+                        break
                             
-                currentHeader = line[1:].split(" ")[0]
-                currentSeq=""
-                foundSequenceOfInterest = currentHeader in fasta_headers_of_interest
+                currentHeader = sequenceName(line[1:])
+                currentSeq = []
+                foundSequenceOfInterest = currentHeader in features_by_seqid
                 
             elif not foundSequenceOfInterest:
                 continue 
             else:
-                currentSeq+= line
-                
+                currentSeq.append(line)
+        
+        #the last sequence of the file is not followed by another header
+        if foundSequenceOfInterest:
+            self._assignReadingFramesOfContig(features_by_seqid[currentHeader], "".join(currentSeq), executor, pending)
         inp.close()
-        
\ No newline at end of file
+        
+        if executor is not None:
+            with executor:
+                for features, future in pending:
+                    self._assignScores(features, future.result())
+    
+    
+    def _assignReadingFramesOfContig(self, features, genomeseq, executor=None, pending=None):
+        if executor is None:
+            self._assignReadingFrames(features, [self.extractSequence(feature, genomeseq) for feature in features])
+            return
+        for i in range(0, len(features), SCORING_CHUNK_SIZE):
+            chunk = features[i:i+SCORING_CHUNK_SIZE]
+            sequences = [self.extractSequence(feature, genomeseq) for feature in chunk]
+            pending.append((chunk, executor.submit(FastaParser.scoreSequences, sequences, [self._getTranslTable(feature) for feature in chunk])))
+
+
+#the FASTA index of a scoring worker process (see FastaParser._guessBestReadingFrameInPool)
+_scoring_index = None
+
+def _openScoringIndex(fasta_path):
+    """Initializer of the scoring workers. The index was built by the main process and is only loaded."""
+    global _scoring_index
+    _scoring_index = FastaIndex.loadOrBuild(fasta_path)
+
+def _scoreLocations(locations, transl_tables):
+    """Worker function: reads the sequences of a chunk of features from the FASTA index and scores their reading frames."""
+    sequences = [FastaParser.fetchLocation(location, _scoring_index) for location in locations]
+    return FastaParser.scoreSequences(sequences, transl_tables)
@@ -6,96 +6,32 @@ This will help to check whether GFF features are permissable as DDBJ entries and
 from utils.FastaParser import FastaParser
 from utils.Parameters import Parameters
 from utils.features import Feature, CompoundFeature, TruncatedLeftFeature, TruncatedRightFeature,TruncatedFeature, TruncatedBothSidesFeature
+from utils.FeatureRegistry import FeatureRegistry, featuresOfType
+from utils.IntervalIndex import FeatureIndex
+from utils import DDBJSchema
 import re
 class FeatureConverter:
     
-    def __init__(self):
-        self.parseFeatureList()
-        #in order to easily find features that have a mismatch in lower/upper case
-        #we'll also make a dict that maps alternative names to each DDBJ feature
-        self.generateFeatureMappings()
-        self.generateQualifierMappings()
-              
-    def parseFeatureList(self):
-        """Parses the 'DDBJ_Features.tsv' file, which contains the information
-        on allowed DDBJ features and qualifiers.
-        """
-        self.ddbj_features = dict()
-        
-        with open("DDBJ_Features.tsv", 'rt') as f:
-            for i, line in enumerate(f):
-                if i==0:
-                    continue
-                line = line.replace("\n", "")
-                s = line.split("\t")
-                feature_dict = self.ddbj_features.get(s[0])
-                if feature_dict is None:
-                    feature_dict = dict()
-                    feature_dict["Mandatory"] = set()
-                    feature_dict["Optional"] = set()
-                    self.ddbj_features[s[0]] = feature_dict
-                
-                if s[1] == 'M':
-                    mandatory_set = feature_dict.get("Mandatory")
-                    mandatory_set.add(s[2])
-                    
-                elif s[1] == 'O':
-                    optional_set = feature_dict.get("Optional")
-                    optional_set.add(s[2])
-    
-    
-    def generateFeatureMappings(self):
-        """Generates a dict that maps various spelling variations to the correct DDBJ Feature type"""
-        self.ddbj_feature_mappings = dict()
-        
-        self.ddbj_feature_mappings["cDNA"] = 'mRNA'
-        self.ddbj_feature_mappings["cdna"] = 'mRNA'
-        self.ddbj_feature_mappings["CDNA"] = 'mRNA'
-        
-        for k in self.ddbj_features.keys():
-            alt_names = set()
-            alt_names.add(k)
-            alt_names.add(k.replace("'", "-"))
-            alt_names.add(k.replace("-", ""))
-            alt_names.add(k.replace("-", "_"))
-            alt_names.add(k.replace("_", "-"))
-            alt_names.add(k.replace("_", ""))
-            alt_names.add(k.replace("3'UTR", "three_prime_UTR"))
-            alt_names.add(k.replace("3", "three"))
-            alt_names.add(k.replace("5'UTR", "five_prime_UTR"))
-            alt_names.add(k.replace("5", "five"))
-            
-            for alt_name in alt_names:
-                self.ddbj_feature_mappings[alt_name] = k
-            for alt_name in alt_names:
-                self.ddbj_feature_mappings[alt_name.lower()] = k  
+    #feature types that are kept if not all features are exported
+    CDS_EXPORT_TYPES = ("gene", "CDS", "source")
+    #feature types that are split into pieces by assembly gaps
+    SPLIT_AT_GAP_TYPES = ("CDS", "mRNA", "exon", "intron", "5'UTR", "3'UTR")
     
+    def __init__(self, print_warnings=True):
+        #warnings are collected instead of printed when the conversion runs in parts (see Conversion.ConversionReport)
+        self.print_warnings = print_warnings
+        self.invalid_gff_feature_types = set()
+        #the allowed DDBJ features and qualifiers, as well as the spelling variations of their names (see DDBJSchema)
+        self.schema = DDBJSchema.getSchema()
+        self.ddbj_feature_mappings = self.schema.feature_mappings
+        self.ddbj_qualifier_mappings = self.schema.qualifier_mappings
     
     
-    def generateQualifierMappings(self):
-        """Generates a dict that maps various spelling variations to the correct DDBJ qualifier"""
-        self.ddbj_qualifier_mappings = dict()
-        qualifiers = set()
-        for _dict in self.ddbj_features.values():
-            qualifiers.update(_dict["Mandatory"])
-            qualifiers.update(_dict["Optional"])
-            
-        for qualifier in qualifiers:
-            self.ddbj_qualifier_mappings[qualifier] = qualifier
-            self.ddbj_qualifier_mappings[qualifier.replace("_", "-")] = qualifier
-            self.ddbj_qualifier_mappings[qualifier.replace("_", "")] = qualifier
-            self.ddbj_qualifier_mappings[qualifier.lower()] = qualifier
-            self.ddbj_qualifier_mappings[qualifier.lower().replace("_", "-")] = qualifier
-            self.ddbj_qualifier_mappings[qualifier.lower().replace("_", "")] = qualifier
-        
-        #self.ddbj_qualifier_mappings["ID"] = "locus_tag"
-        #self.ddbj_qualifier_mappings["id"] = "locus_tag"
-        #self.ddbj_qualifier_mappings["Id"] = "locus_tag"
-        
-    
-    def _addSourceFeatures(self, gff_feature_dict):
+    def _addSourceFeatures(self, gff_feature_dict, grouped_locations):
         """DDBJ annotation files require a 'source' feature. Typically, this source represents the chromosome or contig
         and we can therefore use the GFF seqid to obtain the data from the fasta file.
+        grouped_locations maps the seqids to the features that become the children of the source (see _checkAndFilterFeatures).
+        The source features are checked like all other features.
         """
         needs_submitter_seqid = False
         try:
@@ -105,15 +41,6 @@ class FeatureConverter:
         except:
             pass 
         
-        grouped_locations = dict()
-        
-        for key, feature in gff_feature_dict.items():
-            group = grouped_locations.get(feature.seqid)
-            if group is None:
-                group = {"name":feature.seqid, "features":[]}
-                grouped_locations[feature.seqid] = group
-            group["features"].append(feature)
-        
         for group_key, group in grouped_locations.items():
             start = 1
             end = FastaParser.fasta_dict[group_key]
@@ -123,12 +50,14 @@ class FeatureConverter:
                 
             group_feature = Feature(seqid=group_key,gfftype="source", start=start, end=end, attribute_dict=attr)
             
-            #Drop all hierarchies in all subnodes and make the source feature the parent of all children
-            group_feature.children = group["features"]
+            #Drop all hierarchies in all subnodes and make the source feature the parent of all children.
+            #Later steps (i.e. _splitFeaturesWithGaps) rely on this flat hierarchy and only visit the children of the sources
+            group_feature.children = group
             for child in group_feature.children:
                 child.parent = group_feature
                 child.children.clear()
-            gff_feature_dict[group_key] = group_feature
+            group_feature.removeDuplicateChildren()
+            self._addCheckedSource(gff_feature_dict, group_key, group_feature)
         
         #finally we need to also add all contigs/chromosomes that
         #are present in the fasta file, but not in the GFF file
@@ -140,68 +69,85 @@ class FeatureConverter:
             if needs_submitter_seqid:
                 attr["submitter_seqid"] = key
             feature = Feature(seqid=key,gfftype="source", start=start, end=end, attribute_dict=attr)
-            gff_feature_dict[key] = feature
+            self._addCheckedSource(gff_feature_dict, key, feature)
     
+    def _addCheckedSource(self, gff_feature_dict, key, source_feature):
+        """Source features without qualifiers are not added, as with all other features."""
+        self._checkQualifiersOfFeature(source_feature)
+        if len(source_feature.attributes)==0:
+            gff_feature_dict.pop(key, None)
+        else:
+            gff_feature_dict[key] = source_feature
     
-    def _removePlaceHolderTranscriptsFeatures(self, gff_feature_dict):
-        """During the parsing of the GFF file, we may have added mRNA features that were never present in the GFF file.
-        We'll now remove these mRNA's, since writing them to the annotation could lead to the wrong conclusion that these
-        mRNA's experimentally obtained """
-        if Parameters.gff_contains_transcripts:
-            #the original gff file provided transcripts. We shouldn't remove the mRNAs
-            return
-        
-        to_remove_keys = set()
-        for key, feature in gff_feature_dict.items():
-            if feature.gfftype == "mRNA":
-                to_remove_keys.add(key)
-                for child in feature.children:
-                    child.parent = feature.parent
-                    
-        [gff_feature_dict.pop(r) for r in to_remove_keys]
-     
-    def _removeGeneFeatures(self, gff_feature_dict):
+    
+    @staticmethod
+    def checkSeqids(seqids):
+        """Exits if features belong to sequences that are not present in the FASTA file."""
+        missing = [seqid for seqid in seqids if seqid not in FastaParser.fasta_dict]
+        if len(missing)>0:
+            print("ERROR: The GFF file contains features of sequences that are not present in the FASTA file:", ", ".join(missing[:10]) + (" ..." if len(missing)>10 else ""))
+            import sys
+            sys.exit(1)
+    
+    
+    def _dissolveGene(self, feature, downstream_children):
         """Genes are not allowed in DDBJ annotation files. Instead of simply removing them,
-        we should try and pass the information of the Gene on to it's child features if possible."""
-        to_remove_keys = set()
-        for key, feature in gff_feature_dict.items():
-            if feature.gfftype.lower() == "gene":
-                to_remove_keys.add(key)
-                #let's transfer the gene annotation to all downstream CDS and mRNA's, introns, exons, etc
-                child_features_to_augment = set()
-                child_features_to_augment.update(feature.getAllDownstreamChildren())
-                for child in child_features_to_augment:
-                    #copy all gene attributes from to CDS/mRNA if no conflicting attribute is present
-                    for gene_attr in feature.attributes.keys():
-                        if gene_attr not in child.attributes.keys():
-                            child.attributes[gene_attr] = feature.attributes[gene_attr]
-                            
-                #let's dissolve the child/parent relationships for the gene node
-                for child in feature.children:
-                    child.parent = feature.parent
-                feature.children = None #unnecessary but throws an error if the feature is accidentally used elsewhere
-        #Let's remove the gene feature
-        [gff_feature_dict.pop(r) for r in to_remove_keys]
+        we pass the attributes of the gene on to its downstream children and detach the gene from the hierarchy."""
+        #let's transfer the gene annotation to all downstream CDS and mRNA's, introns, exons, etc
+        for child in downstream_children:
+            #copy all gene attributes from to CDS/mRNA if no conflicting attribute is present
+            for gene_attr in feature.attributes.keys():
+                if gene_attr not in child.attributes.keys():
+                    child.attributes[gene_attr] = feature.attributes[gene_attr]
+                    
+        #let's dissolve the child/parent relationships for the gene node
+        for child in feature.children:
+            child.parent = feature.parent
+        feature.children = None #unnecessary but throws an error if the feature is accidentally used elsewhere
+    
+    def _convertGeneFeatures(self, gff_feature_dict):
+        """Assigns the locus tags (_fixLocusTagOfGene) and removes the genes (_dissolveGene), each gene is visited only once.
+        If not all features are exported, the gene is first reduced to the children that are kept (_keepExportedChildren)."""
+        to_remove_keys = []
+        for key, feature in featuresOfType(gff_feature_dict, "gene"):
+            to_remove_keys.append(key)
+            if not Parameters.export_all:
+                self._keepExportedChildren(feature)
+            downstream_children = feature.getAllDownstreamChildren()
+            self._fixLocusTagOfGene(feature, downstream_children)
+            self._dissolveGene(feature, downstream_children)
+        for r in to_remove_keys:
+            gff_feature_dict.pop(r)
     
     
     def addAssemblyGaps(self, gff_feature_dict, gaps):
         """Adds assembly gaps found in the FASTA file to the feature_dict"""
+        new_keys = []
         for contig_name in gaps.keys():
             gaplist = gaps[contig_name]
             for i, gap in enumerate(gaplist):
                 attr = Parameters.assembly_gap_attributes.copy()
+                if len(gap) > 2:
+                    #the gap provides its own qualifiers (i.e. from an AGP file)
+                    attr.update(gap[2])
                 name = contig_name+"_assembly_gap_"+str(i)
                 f = Feature(seqid=contig_name, gfftype="assembly_gap", start=gap[0]+1, end=gap[1], strand="+", attribute_dict=attr)
                 f.parent = gff_feature_dict.get(contig_name)
                 gff_feature_dict.get(contig_name).children.append(f)
                 gff_feature_dict[name] = f
+                new_keys.append(name)
                 
-        self._splitCDSWithGaps(gff_feature_dict)
+        new_keys.extend(self._splitFeaturesWithGaps(gff_feature_dict))
             
         #if CDS sequences were split, they will contain the ID attribute again
-        #therefore:
-        self._checkValidityOfQualifiers(gff_feature_dict)
-        self._removeEntriesWithouthQualifiers(gff_feature_dict)
+        #therefore the qualifiers of the gaps and split features are checked. All other features were already checked by convertFeatures
+        for key in new_keys:
+            feature = gff_feature_dict.get(key)
+            if feature is None:
+                continue
+            self._checkQualifiersOfFeature(feature)
+            if len(feature.attributes)==0:
+                gff_feature_dict.pop(key)
         self._removeDuplicateFeatures(gff_feature_dict)
         
     
@@ -210,63 +156,66 @@ class FeatureConverter:
     
     
         
-    def _fixLocusTagsAndGeneNames(self, gff_feature_dict):
+    def _fixLocusTagOfGene(self, feature, downstream_children=None):
         """The DDBJ locus tag naming convention is very strict.
         The locus tag must be preceded by a locus tag prefix, separated by an underscore. Locus tags are assigned to most subfeatures 
         of genes and these subfeatures must have the identical locus tag as the corresponding gene BUT the tag cannot be the same as the gene name.
         Also, in case all subfeatures share the same locus_tag and have a gene qualifier, then the locus_tag should be removed in favour of the gene name.
          Note: this function will assign the genes locus tag to all subfeatures, regardless of the type. Invalid assigning of the locus_tag 
-         qualifier will need to be filtered out by _checkValidityOfQualifiers()
+         qualifier will need to be filtered out by _checkQualifiersOfFeature()
         """
         prefix = Parameters.locus_attributes["locus_tag_prefix"]
         need_to_add_prefix = prefix!=""
         
-        for key, feature in gff_feature_dict.items():
-            if feature.gfftype == 'gene':
-                locus_tag = feature.attributes.get("locus_tag")
-                if locus_tag is None:
-                    #need to build a locus tag from the gene name and strip all non-numeric values
-                    locus_tag = feature.getAttribute("gene")
-                    locus_tag = re.sub('[^0-9]','', locus_tag)
-                    #let's pad the number with zeros
-                    locus_tag = ("0"*(8-len(locus_tag)))+locus_tag
-                    
+        locus_tag = feature.attributes.get("locus_tag")
+        if locus_tag is None:
+            #need to build a locus tag from the gene name and strip all non-numeric values
+            locus_tag = feature.getAttribute("gene")
+            #the number that makes a duplicate ID unique (ID#1, see GFFParser) is not part of the gene number,
+            #otherwise g1#1 would become 11 and collide with g11
+            locus_tag = re.sub('#[0-9]+$','', locus_tag)
+            locus_tag = re.sub('[^0-9]','', locus_tag)
+            #let's pad the number with zeros
+            locus_tag = ("0"*(8-len(locus_tag)))+locus_tag
+            
+        
+        if need_to_add_prefix:
+            #remove underscores since they are not permissible
+            if "_" in locus_tag:
+                locus_tag = locus_tag.replace("_", "")
                 
-                if need_to_add_prefix:
-                    #remove underscores since they are not permissible
-                    if "_" in locus_tag:
-                        locus_tag = locus_tag.replace("_", "")
-                        
-                    locus_tag = prefix+"_"+locus_tag
-                    feature.attributes["locus_tag"] = locus_tag
-                    
-                    #we will now assign the gene and locus tag to all downstream children 
-                    for child in feature.getAllDownstreamChildren():
-                        #We will assign both gene and locus tag at this point.
-                        #During the _checkValidityOfQualifiers step, the correct choice
-                        #the locus tag may be removed depending on the circumstances.
-                        child.attributes["gene"] = feature.attributes["gene"]
-                        child.attributes["locus_tag"] = locus_tag
-                        if Parameters.gene_as_note:
-                            notes = child.attributes.get("note")
-                            if notes is None:
-                                notes = []
-                                child.attributes["note"] = notes
-                            notes.append("gene_ID: "+feature.attributes["gene"])
+            locus_tag = prefix+"_"+locus_tag
+            feature.attributes["locus_tag"] = locus_tag
+            
+            if downstream_children is None:
+                downstream_children = feature.getAllDownstreamChildren()
+            #we will now assign the gene and locus tag to all downstream children 
+            for child in downstream_children:
+                #We will assign both gene and locus tag at this point.
+                #During the _checkQualifiersOfFeature step, the correct choice
+                #the locus tag may be removed depending on the circumstances.
+                child.attributes["gene"] = feature.attributes["gene"]
+                child.attributes["locus_tag"] = locus_tag
+                if Parameters.gene_as_note:
+                    notes = child.attributes.get("note")
+                    if notes is None:
+                        notes = []
+                        child.attributes["note"] = notes
+                    notes.append("gene_ID: "+feature.attributes["gene"])
 
     
     def _removeDuplicateFeatures(self, gff_feature_dict):
-        feature_keys_to_remove = set()
-        hash_set = set()
-        
+        feature_keys_to_remove = []
+        key_set = set()
+        #the features are children of a source as well as entries of the dict, their keys are only computed once (see Feature.getStructuralKey)
         for key, feature in gff_feature_dict.items():
             feature.removeDuplicateChildren()
             
-            h = feature.getHash()
-            if h in hash_set:
-                feature_keys_to_remove.add(key)
+            k = feature.getStructuralKey()
+            if k in key_set:
+                feature_keys_to_remove.append(key)
             else:
-                hash_set.add(h)
+                key_set.add(k)
         
         for fkr in feature_keys_to_remove:
             gff_feature_dict.pop(fkr)
@@ -288,166 +237,149 @@ class FeatureConverter:
         return mod
         
     
-    def _addAdditionalCDSQualifiers(self, gff_feature_dict):
+    def _addCDSQualifiersToFeature(self, feature):
         """DDBJ annotations require CDS features to contain transl_table and codon_start.
         codon_start represents the ORF offset and would typically be 1, since a CDS starts with the start codon.
         However, the CDS may also be a truncated CDS with an unknown start or end. We'll try to infer the codon_start
         in such cases.
         transl_table will always be set to 1 if no other value was provided via the command line.
         """
-                   
-        for key, feature in gff_feature_dict.items():
-            if feature.gfftype == "CDS":
-                tt = feature.attributes.get("transl_table")
-                if tt is None:
-                    tt = "1"
-                    feature.attributes["transl_table"] = tt
-                        
-                cs = feature.attributes.get("codon_start")
-                if cs is None:
-                    
-                    cs = str((int(feature.phase)+1))
-                    
-                    feature.attributes["codon_start"] = cs
+        tt = feature.attributes.get("transl_table")
+        if tt is None:
+            tt = "1"
+            feature.attributes["transl_table"] = tt
+                
+        cs = feature.attributes.get("codon_start")
+        if cs is None:
+            
+            cs = str((int(feature.phase)+1))
+            
+            feature.attributes["codon_start"] = cs
     
     def _addExonIntronNumbers(self, gff_feature_dict):
         """Exons and introns need to be numbered by occurence in 5->3 direction."""
         #We will first need to regroup the exons and introns by their corresponding gene tags
         gene_groups = dict()
-        for key, feature in gff_feature_dict.items():
-            if feature.gfftype == "exon" or feature.gfftype == "intron":
-                gene_group = gene_groups.get(feature.getAttribute("gene"))
-                if gene_group is None:
-                    gene_group = []
-                    gene_groups[feature.getAttribute("gene")] = gene_group
-                gene_group.append(feature)
-                
+        for key, feature in featuresOfType(gff_feature_dict, ["exon", "intron"]):
+            gene_group = gene_groups.get(feature.getAttribute("gene"))
+            if gene_group is None:
+                gene_group = []
+                gene_groups[feature.getAttribute("gene")] = gene_group
+            gene_group.append(feature)
+            
         for group in gene_groups.values():
             group.sort(key=lambda x: x.start, reverse=True if group[0].strand == "-" else False)
             for i, element in enumerate(group):
                 element.attributes["number"] = str(i+1)
                
      
-    def _splitCDSWithGaps(self, gff_feature_dict):
-        """Finds assembly_gaps that lie within the bounds of a CDS, and splits the CDS into two pieces"""
-        #TODO: mRNA's should be split as well
-        #TODO: exons/introns should probably be split as well
-        
+    def _splitFeaturesWithGaps(self, gff_feature_dict):
+        """Finds assembly_gaps that lie within the bounds of CDS, mRNA, exon, intron and UTR features, and splits these features into pieces.
+        The gaps are kept in a FeatureIndex, so that only the gaps overlapping a feature are visited. After a split,
+        only the right piece can overlap further gaps, so features with multiple gaps are split one gap after another.
+        Returns the keys of the added pieces."""
+        gap_index = FeatureIndex([gap for key, gap in featuresOfType(gff_feature_dict, "assembly_gap")])
+        #the keys of the features, so that they don't need to be searched in the dict
+        feature_keys = {id(feature):key for key, feature in featuresOfType(gff_feature_dict, FeatureConverter.SPLIT_AT_GAP_TYPES)}
         features_to_add = []
-        keys_to_remove = set()
+        keys_to_remove = []
         
-        for key, feature in gff_feature_dict.items():
-            if feature.gfftype == 'source':
-                cds_list = list(feature.getAllDownstreamOfType("CDS"))
-                cds_list.sort(key=lambda x: x.start)
-                
-                gap_list = list(feature.getAllDownstreamOfType("assembly_gap"))
-                gap_list.sort(key=lambda x: x.start)
+        for key, source in featuresOfType(gff_feature_dict, "source"):
+            if not gap_index.hasFeatures(source.seqid, "assembly_gap"):
+                continue
+            #the hierarchy below the sources is flat (see _addSourceFeatures). Taking the features in the order of the children (instead of the set
+            #returned by getAllDownstreamOfType) keeps the order of features with the same start deterministic
+            feature_list = [child for child in source.children if child.gfftype in FeatureConverter.SPLIT_AT_GAP_TYPES]
+            feature_list.sort(key=lambda x: x.start)
+            
+            split_features = set()
+            pieces = []
+            for feature in feature_list:
+                current = feature
+                current_key = feature_keys.get(id(feature))
+                for gap in gap_index.overlapping(source.seqid, feature.start, feature.end, "assembly_gap"):
+                    if not FeatureConverter._gapRequiresSplit(current, gap):
+                        continue
+                    left, right = current.split(gap.start, gap.end)
+                    left_empty = left.end < left.start
+                    right_empty = right.start > right.end
+                    if left_empty and right_empty:
+                        #the feature lies within the gap
+                        continue
+                    if current is feature:
+                        split_features.add(id(feature))
+                        if current_key is not None:
+                            keys_to_remove.append(current_key)
+                    if left_empty or right_empty:
+                        #the gap only covers one end of the feature (i.e. an exon next to an intron), so the feature is truncated instead
+                        current = left if right_empty else right
+                        continue
+                    pieces.append(left)
+                    if current_key is not None:
+                        features_to_add.append((current_key+"_l", left))
+                        current_key = current_key+"_r"
+                    current = right
                 
-                #we will iterate through the sorted CDS and gap list to find overlaps of CDSs and gaps
-                gap_index = 0
-                cds_index = 0
-                while(gap_index<len(gap_list) and cds_index<len(cds_list)):
-                    cds = cds_list[cds_index]
-                    gap = gap_list[gap_index]
-                    if cds.end < gap.start:
-                        cds_index+=1
-                    elif gap.end < cds.start:
-                        gap_index +=1
-                    else:
-                        #compound CDS's don't necessarily need a split, since the gap may lie inside an intron
-                        split_required = False
-                        if isinstance(cds, CompoundFeature):
-                            for subcds in cds.members:
-                                if subcds.end<gap.start or gap.end<subcds.start:
-                                    continue
-                                else:
-                                    split_required = True
-                        else:
-                            split_required = True
-                            
-                        if split_required:
-                            #print("Split required!")
-                            split_cdss = cds.split(gap.start, gap.end)
-                            left = split_cdss[0]
-                            right = split_cdss[1]
-                            
-                            feature.children.remove(cds)
-                            feature.children.append(left)
-                            feature.children.append(right)
-                                
-                            #we need the key of the cds feature
-                            cds_keys = [k for k, val in gff_feature_dict.items() if val == cds]
-                            if len(cds_keys)==0:
-                                #the key was not found, because it's a CDS that was previously split and hasn't
-                                #been added to the gff_feature_dict yet
-                                cds_keys = [k for k, val in features_to_add if val == cds]
-                                
-                            cds_key = cds_keys[0]
-                            keys_to_remove.add(cds_key)
-                            features_to_add.append((cds_key+"_l", left))
-                            features_to_add.append((cds_key+"_r", right))
-                            
-                            #also, a single CDS could have multiple gaps. We need to re-generate the cds_list
-                            #since the newly split CDS will now be found via getAllDownstreamOfType
-                            cds_list = list(feature.getAllDownstreamOfType("CDS"))
-                            cds_list.sort(key=lambda x: x.start)
-                            gap_index-=1 # we want to rerun the same gap again in case we have multiple CDS's affected by the same gap
-                        
-                        gap_index+=1
+                if current is not feature:
+                    pieces.append(current)
+                    if current_key is not None:
+                        features_to_add.append((current_key, current))
+            
+            if len(split_features)>0:
+                source.children = [child for child in source.children if id(child) not in split_features]
+                source.children.extend(pieces)
         
         for k in keys_to_remove:
-            try:
-                gff_feature_dict.pop(k)
-            except:
-                pass
+            gff_feature_dict.pop(k, None)
             
         for key, value in features_to_add:
             gff_feature_dict[key] = value 
+        return [key for key, value in features_to_add]
+    
+    
+    @staticmethod
+    def _gapRequiresSplit(feature, gap):
+        if feature.end < gap.start or gap.end < feature.start:
+            return False
+        #compound features (i.e. CDS's) don't necessarily need a split, since the gap may lie inside an intron
+        if isinstance(feature, CompoundFeature):
+            for member in feature.members:
+                if not (member.end<gap.start or gap.end<member.start):
+                    return True
+            return False
+        return True
     
     
           
-    def removeAllButCDS(self, gff_feature_dict):
-        """Removes all features, except CDS and source."""
-        keys_to_remove = set()
-        for key, feature in gff_feature_dict.items():
-            if feature.gfftype == 'source' or feature.gfftype == 'CDS':
-                continue
-            
-            keys_to_remove.add(key)
-            for child in feature.children:
-                child.parent = feature.parent
-            feature.children.clear()
-            
-            if feature.parent is not None:
-                feature.parent.removeChild(feature)
-            
-        for k in keys_to_remove:
-            try:
-                gff_feature_dict.pop(k)
-            except:
-                pass
-        
-                    
+    def _keepExportedChildren(self, gene):
+        """If only CDS features are exported, the features in between a gene and its CDS are dropped (see _convertTypesAndQualifiers).
+        Features with mandatory qualifiers (i.e. ncRNA) are kept as well, so that they are still validated
+        by _checkAndFilterFeatures before they are removed. These features and the CDS become direct children of their gene."""
+        kept_children = [child for child in gene.getAllDownstreamChildren() if child.gfftype == "CDS" or self._requiresValidation(child.gfftype)]
+        kept_children.sort(key=lambda x: (x.start, x.end))
+        for child in kept_children:
+            child.parent = gene
+        gene.children = kept_children
+    
+    
+    def _requiresValidation(self, gfftype):
+        """Features with mandatory qualifiers need to be validated, even if they are not exported."""
+        return self.schema.mandatory_masks.get(gfftype, 0) != 0
+    
+    def _isKeptBeforeExport(self, gfftype):
+        return gfftype in FeatureConverter.CDS_EXPORT_TYPES or self._requiresValidation(gfftype)
+    
+    
     def convertFeatures(self, gff_feature_dict):
-        
-        self._addAdditionalCDSQualifiers(gff_feature_dict)
-        self._mapGFF_Features(gff_feature_dict)
-        self._mapQualifiers(gff_feature_dict)
-        self._fixLocusTagsAndGeneNames(gff_feature_dict)
-        self._removePlaceHolderTranscriptsFeatures(gff_feature_dict)
+        """Converts the GFF features into DDBJ features in two passes over all features: the first converts the types and qualifiers
+        and drops the features that are not needed, the second checks the qualifiers, removes duplicates and adds the source features.
+        The genes are dissolved in between, since they need the converted types of all of their children.
+        Exons and introns are numbered afterwards (type index only)."""
+        self._convertTypesAndQualifiers(gff_feature_dict)
         #self._removeCDSWithBothSidesTruncated(gff_feature_dict)
-        self._removeGeneFeatures(gff_feature_dict)
-        self._addSourceFeatures(gff_feature_dict)
-        self._checkValidityOfQualifiers(gff_feature_dict)
-        self._removeEntriesWithouthQualifiers(gff_feature_dict)
+        self._convertGeneFeatures(gff_feature_dict)
+        self._checkAndFilterFeatures(gff_feature_dict)
         
-        if not Parameters.export_all:
-            self.removeAllButCDS(gff_feature_dict)
-        
-        #Braker2 was found to annotate the same region multiple times, with slightly different ID's
-        #after conversion, it is possible that we end up with identical features. Let's remove them
-        self._removeDuplicateFeatures(gff_feature_dict)
         #exon/intron numbers are added after removing of duplicates has succeeded
         #otherwise they would receive different hashes
         if Parameters.export_all:
@@ -458,73 +390,132 @@ class FeatureConverter:
         
         return gff_feature_dict
     
-    def _removeEntriesWithouthQualifiers(self, gff_feature_dict):
-        to_remove = set()
-        
-        for fkey in gff_feature_dict.keys():
-            attr = gff_feature_dict[fkey].attributes
-            if len(attr)==0:
-                to_remove.add(fkey)
-
-        [gff_feature_dict.pop(r) for r in to_remove]
-        
-    def _checkValidityOfQualifiers(self, gff_feature_dict):
+    def _convertTypesAndQualifiers(self, gff_feature_dict):
+        """A single pass that adds the CDS qualifiers (_addCDSQualifiersToFeature), maps the feature types (_convertGFF_FeatureType)
+        and maps the qualifiers (_mapQualifiersOfFeature). Features of invalid types are removed, and so are the features that are
+        not exported (see _isKeptBeforeExport) and the mRNA's that were only added as placeholders by the GFFParser.
+        The removed features stay in the hierarchy, so that the genes can still reach their CDS (see _convertGeneFeatures)."""
+        invalid_gff_feature_types = set()
+        gff_features_to_remove = []
+        is_registry = isinstance(gff_feature_dict, FeatureRegistry)
+        #if the original gff file provided transcripts, the mRNA's shouldn't be removed
+        remove_transcripts = not Parameters.gff_contains_transcripts
         
-        for fkey in gff_feature_dict.keys():
-            feature = gff_feature_dict[fkey]
-            filtered_attributes = dict()
-            for qualifier in feature.attributes.keys():
-                if qualifier in self.ddbj_features[feature.gfftype]["Mandatory"] or qualifier in self.ddbj_features[feature.gfftype]["Optional"]:
-                    filtered_attributes[qualifier] = feature.attributes[qualifier]
-            feature.attributes = filtered_attributes
+        for fkey, feature in gff_feature_dict.items():
+            if feature.gfftype == "CDS":
+                self._addCDSQualifiersToFeature(feature)
             
-            #delete the gene qualifier if genes are written as notes
-            if Parameters.gene_as_note:
-                if feature.hasAttribute("gene", True) and feature.hasAttribute("note", True):
-                    feature.attributes.pop("gene")
+            converted_type = self._convertGFF_FeatureType(feature.gfftype)
+            if converted_type is None:
+                gff_features_to_remove.append(fkey)
+                invalid_gff_feature_types.add(feature.gfftype)
+                continue
+            elif is_registry:
+                gff_feature_dict.retype(fkey, converted_type)
+            else:
+                feature.gfftype = converted_type
             
-            #If both gene and locus_tag qualifiers are present and identical, keep only the gene qualifier
-            if feature.attributes.get("gene") is not None and feature.attributes.get("locus_tag") is not None:
-                if feature.attributes.get("gene") == feature.attributes.get("locus_tag"):
-                    if Parameters.gene_as_note:
-                        feature.attributes.pop('gene')
-                    else:
-                        feature.attributes.pop('locus_tag')
+            if remove_transcripts and converted_type == "mRNA":
+                #writing mRNA's that were never present in the GFF file could lead to the wrong conclusion that they were experimentally obtained
+                gff_features_to_remove.append(fkey)
+                for child in feature.children:
+                    child.parent = feature.parent
+            elif Parameters.export_all or self._isKeptBeforeExport(converted_type):
+                self._mapQualifiersOfFeature(feature)
+            else:
+                #if only CDS features are exported, the attributes of the other features never need to be parsed
+                gff_features_to_remove.append(fkey)
+        
+        for r in gff_features_to_remove:
+            gff_feature_dict.pop(r)
+        self.invalid_gff_feature_types.update(invalid_gff_feature_types)
+        if self.print_warnings and len(invalid_gff_feature_types)>0:
+            print("WARNING: The following invalid feature types will be omitted: ", invalid_gff_feature_types)
+    
+    
+    def _checkAndFilterFeatures(self, gff_feature_dict):
+        """A single pass that checks the qualifiers (_checkQualifiersOfFeature), removes features without qualifiers,
+        all features except CDS and source if not all features are exported, and duplicated features.
+        The remaining features are grouped by their seqid and become the children of the source features (_addSourceFeatures).
+        Features without qualifiers are only removed from the dict, but not from the children of their source."""
+        keys_to_remove = []
+        grouped_locations = dict() #seqid -> features
+        #Braker2 was found to annotate the same region multiple times, with slightly different ID's
+        #after conversion, it is possible that we end up with identical features. Let's remove them
+        key_set = set()
+        for key, feature in gff_feature_dict.items():
+            self._checkQualifiersOfFeature(feature)
+            has_attributes = len(feature.attributes)>0
+            if has_attributes:
+                if not Parameters.export_all and feature.gfftype != 'source' and feature.gfftype != 'CDS':
+                    keys_to_remove.append(key)
+                    continue
+                k = feature.getStructuralKey()
+                if k in key_set:
+                    keys_to_remove.append(key)
+                    continue
+                key_set.add(k)
+            else:
+                keys_to_remove.append(key)
             
-            all_mandatory_present = True
-            for mandatory_qualifier in self.ddbj_features[feature.gfftype]["Mandatory"]:
-                if mandatory_qualifier not in filtered_attributes.keys():
-                    all_mandatory_present = False
-            if not all_mandatory_present:
-                print(f"ERROR: Mandatory qualifier missing in GFF type {feature}.\nDDBJ requires the following qualifiers for this feature:", self.ddbj_features[feature.gfftype]["Mandatory"])
-                import sys
-                sys.exit(1)
+            group = grouped_locations.get(feature.seqid)
+            if group is None:
+                group = []
+                grouped_locations[feature.seqid] = group
+            group.append(feature)
+        
+        for r in keys_to_remove:
+            gff_feature_dict.pop(r)
+        self._addSourceFeatures(gff_feature_dict, grouped_locations)
+    
+    
+    def _checkQualifiersOfFeature(self, feature):
+        allowed_mask = self.schema.allowed_masks[feature.gfftype]
+        qualifier_bits = self.schema.qualifier_bits
+        filtered_attributes = dict()
+        for qualifier, value in feature.attributes.items():
+            if qualifier_bits.get(qualifier, 0) & allowed_mask:
+                filtered_attributes[qualifier] = value
+        feature.attributes = filtered_attributes
+        
+        #delete the gene qualifier if genes are written as notes
+        if Parameters.gene_as_note:
+            if feature.hasAttribute("gene", True) and feature.hasAttribute("note", True):
+                feature.attributes.pop("gene")
+        
+        #If both gene and locus_tag qualifiers are present and identical, keep only the gene qualifier
+        if feature.attributes.get("gene") is not None and feature.attributes.get("locus_tag") is not None:
+            if feature.attributes.get("gene") == feature.attributes.get("locus_tag"):
+                if Parameters.gene_as_note:
+                    feature.attributes.pop('gene')
+                else:
+                    feature.attributes.pop('locus_tag')
+        
+        mandatory_mask = self.schema.mandatory_masks[feature.gfftype]
+        if mandatory_mask & ~self.schema.getMask(filtered_attributes) != 0:
+            print(f"ERROR: Mandatory qualifier missing in GFF type {feature}.\nDDBJ requires the following qualifiers for this feature:", self.schema.getMandatoryQualifiers(feature.gfftype))
+            import sys
+            sys.exit(1)
                 
                 
-    def _mapQualifiers(self, gff_feature_dict):
+    def _mapQualifiersOfFeature(self, gff_feature):
         """Maps/converts GFF qualifiers to DDBJ qualifiers if possible and removes invalid qualifiers otherwise """
-        invalid_qualifiers = set()
+        converted_attributes = dict()
         
-        for fkey in gff_feature_dict.keys():
-            gff_feature = gff_feature_dict[fkey]
-            converted_attributes = dict()
-            
-            for qualifier in gff_feature.attributes.keys():
-                #Special case: GFF ID's are invalid DDBJ qualifiers, and would be removed,
-                #however, we do need to keep this information for genes, since the gene name is required
-                #to be passed to child nodes and also for the locus_tag.
-                converted_qualifier = None
-                if gff_feature.gfftype.lower() == "gene" and qualifier.upper() == "ID" and not gff_feature.hasAttribute("gene"):
-                    converted_qualifier = "gene"
-                else:
-                    converted_qualifier = self._convertQualifier(qualifier)
-                
-                if converted_qualifier is None:
-                    invalid_qualifiers.add(qualifier)
-                else:
-                    converted_attributes[converted_qualifier] = gff_feature.attributes[qualifier]
+        for qualifier in gff_feature.attributes.keys():
+            #Special case: GFF ID's are invalid DDBJ qualifiers, and would be removed,
+            #however, we do need to keep this information for genes, since the gene name is required
+            #to be passed to child nodes and also for the locus_tag.
+            converted_qualifier = None
+            if gff_feature.gfftype.lower() == "gene" and qualifier.upper() == "ID" and not gff_feature.hasAttribute("gene"):
+                converted_qualifier = "gene"
+            else:
+                converted_qualifier = self._convertQualifier(qualifier)
             
-            gff_feature.attributes = converted_attributes
+            if converted_qualifier is not None:
+                converted_attributes[converted_qualifier] = gff_feature.attributes[qualifier]
+        
+        gff_feature.attributes = converted_attributes
             
             
     def _convertQualifier(self, gff_qualifier):
@@ -538,32 +529,6 @@ class FeatureConverter:
                 
             
     
-    def _mapGFF_Features(self, gff_feature_dict):
-        """Checks GFF Feature types and removes/renames invalid feature types"""
-        invalid_gff_feature_types = set()
-        gff_features_to_remove = set()
-        
-        for fkey in gff_feature_dict.keys():
-            gff_feature = gff_feature_dict[fkey]
-            
-            converted_type = self._convertGFF_FeatureType(gff_feature.gfftype)
-            if converted_type is None:
-                gff_features_to_remove.add(fkey)
-                invalid_gff_feature_types.add(gff_feature.gfftype) 
-                continue
-            else:
-                gff_feature.gfftype = converted_type
-        
-        #remove GFF entries with invalid types
-        [gff_feature_dict.pop(r) for r in gff_features_to_remove]
-            
-            #attr_dict = gff_feature.attributes
-            #for akey in gff_feature.attributes.keys():
-        if len(invalid_gff_feature_types)>0:
-            print("WARNING: The following invalid feature types will be omitted: ", invalid_gff_feature_types)
-    
-    
-    
     def _convertGFF_FeatureType(self, gfftype):
         hit = self.ddbj_feature_mappings.get(gfftype)
         if hit is None:
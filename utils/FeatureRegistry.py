@@ -0,0 +1,140 @@
+'''
+A dict of features (key -> feature), which additionally keeps an index of the features by their type.
+Conversion steps that only deal with a single feature type (i.e. CDS or mRNA) can use this index
+instead of iterating over all features.
+'''
+
+
+class FeatureRegistry(dict):
+    """Keys are added, replaced and removed via the regular dict methods, the type index is updated accordingly.
+    Since the index can't notice changes to the gfftype of a feature, renaming must be done via retype()."""
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self)
+        self.by_type = dict() #gfftype -> dict(key -> feature), each in the order of insertion
+        self.unordered_types = set() #types whose index is no longer in the same order as the dict
+        self.update(*args, **kwargs)
+
+
+    def _index(self, key, feature):
+        bucket = self.by_type.get(feature.gfftype)
+        if bucket is None:
+            bucket = dict()
+            self.by_type[feature.gfftype] = bucket
+        bucket[key] = feature
+
+    def _unindex(self, key, feature):
+        bucket = self.by_type.get(feature.gfftype)
+        if bucket is not None and key in bucket:
+            del bucket[key]
+            return
+        #the type of the feature was changed without using retype()
+        for bucket in self.by_type.values():
+            if key in bucket:
+                del bucket[key]
+                return
+
+
+    def __setitem__(self, key, feature):
+        if key in self:
+            old = dict.__getitem__(self, key)
+            self._unindex(key, old)
+            if old.gfftype != feature.gfftype:
+                #the key keeps its position in the dict, but is appended to the index of the new type
+                self.unordered_types.add(feature.gfftype)
+        dict.__setitem__(self, key, feature)
+        self._index(key, feature)
+
+    def __delitem__(self, key):
+        feature = dict.__getitem__(self, key)
+        dict.__delitem__(self, key)
+        self._unindex(key, feature)
+
+    _MISSING = object()
+
+    def pop(self, key, default=_MISSING):
+        if key not in self:
+            if default is FeatureRegistry._MISSING:
+                raise KeyError(key)
+            return default
+        feature = dict.pop(self, key)
+        self._unindex(key, feature)
+        return feature
+
+    def popitem(self):
+        key, feature = dict.popitem(self)
+        self._unindex(key, feature)
+        return key, feature
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, feature in dict(*args, **kwargs).items():
+            self[key] = feature
+
+    def clear(self):
+        dict.clear(self)
+        self.by_type.clear()
+        self.unordered_types.clear()
+
+
+    def __reduce__(self):
+        #the index is rebuilt when unpickling (i.e. in worker processes)
+        return (FeatureRegistry, (dict(self),))
+
+
+    def retype(self, key, gfftype):
+        """Changes the gfftype of the feature stored under the given key and updates the index."""
+        feature = dict.__getitem__(self, key)
+        if feature.gfftype == gfftype:
+            return
+        self._unindex(key, feature)
+        if len(self.by_type.get(gfftype, ())) > 0:
+            self.unordered_types.add(gfftype)
+        feature.gfftype = gfftype
+        self._index(key, feature)
+
+
+    def getTypes(self):
+        """Returns all feature types currently present."""
+        return [t for t, bucket in self.by_type.items() if len(bucket)>0]
+
+
+    def ofType(self, gfftypes):
+        """Returns a list of (key, feature) tuples of all features with the given type(s).
+        For each type, the features are returned in the same order as they are stored in the dict."""
+        items = []
+        for gfftype in typeList(gfftypes):
+            bucket = self.by_type.get(gfftype)
+            if bucket is None:
+                continue
+            if gfftype in self.unordered_types:
+                #restore the dict order of this index
+                ordered = dict()
+                for key, feature in self.items():
+                    if key in bucket:
+                        ordered[key] = feature
+                self.by_type[gfftype] = ordered
+                self.unordered_types.discard(gfftype)
+                bucket = ordered
+            items.extend(bucket.items())
+        return items
+
+
+def typeList(gfftypes):
+    """Returns the given feature type(s) as a collection, so that a single type can be passed as a string."""
+    if not isinstance(gfftypes, list) and not isinstance(gfftypes, set) and not isinstance(gfftypes, tuple):
+        return [gfftypes]
+    return gfftypes
+
+
+def featuresOfType(feature_dict, gfftypes):
+    """Returns the (key, feature) tuples of all features of the given type(s).
+    Uses the type index if the dict is a FeatureRegistry and iterates over all features otherwise."""
+    if isinstance(feature_dict, FeatureRegistry):
+        return feature_dict.ofType(gfftypes)
+    gfftypes = typeList(gfftypes)
+    return [(key, feature) for key, feature in feature_dict.items() if feature.gfftype in gfftypes]
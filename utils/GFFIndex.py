@@ -0,0 +1,195 @@
+'''
+An index that stores where the records of each seqid are located in a GFF file.
+This allows to parse only the contigs that are actually needed, i.e. each worker process can read its own contigs.
+The index is only stored if a cache directory is given (<cache dir>/<gff file name>_<hash of the path>.gffidx),
+nothing is written next to the input files.
+Offsets are byte offsets for plain files and virtual offsets for BGZF files. Regular gzip files can't be indexed,
+since they can only be decompressed from the start.
+
+The index is a tab separated text file. The first line holds the format version, the size and modification time
+of the GFF file (to detect outdated indices), the feature types that decide how the GFF file is converted
+and whether IDs are shared between seqids (see SharedIDFinder).
+Each following line describes one block of consecutive lines of the same seqid: seqid, offset, lines, records.
+Files that are sorted by seqid contain a single block per seqid.
+'''
+import hashlib, io, os
+from utils.BGZFReader import BGZFReader, isBGZF, isGzipped
+from utils.Parameters import Parameters
+from utils.GFFParser import SharedIDFinder
+
+INDEX_VERSION = "2"
+INDEX_SUFFIX = ".gffidx"
+TRAIT_TYPES = ("start_codon", "gene", "mRNA") #feature types whose presence is stored in the index
+
+
+class GFFIndex:
+
+    def __init__(self, gff_path, bgzf, index_dir=None):
+        self.gff_path = gff_path
+        self.index_path = None #the index is kept in memory only
+        if index_dir is not None:
+            path_hash = hashlib.sha1(os.path.abspath(gff_path).encode()).hexdigest()[:16]
+            self.index_path = os.path.join(index_dir, os.path.basename(gff_path)+"_"+path_hash+INDEX_SUFFIX)
+        self.bgzf = bgzf
+        self.blocks = dict() #seqid -> list of [offset, number of lines, number of records]
+        self.traits = set()
+        self.shared_ids = False #if True, the contigs can't be parsed separately
+
+
+    @staticmethod
+    def loadOrBuild(gff_path, index_dir=None):
+        """Returns the index of a GFF file. If an index directory (i.e. the --cache_dir) is given, an existing index is reused
+        if it matches the size and modification time of the GFF file, otherwise the index is built and stored there.
+        Without an index directory, the index is built and only kept in memory.
+        Returns None for gzip compressed files that are not BGZF compressed."""
+        bgzf = isBGZF(gff_path)
+        if not bgzf and isGzipped(gff_path):
+            return None
+
+        index = GFFIndex(gff_path, bgzf, index_dir)
+        if index.index_path is not None and index._load():
+            return index
+        index._build()
+        if index.index_path is not None:
+            try:
+                index._write()
+            except OSError:
+                print("Warning: Could not write the GFF index to", index.index_path)
+        return index
+
+
+    def _fingerprint(self):
+        stat = os.stat(self.gff_path)
+        return [str(stat.st_size), str(stat.st_mtime_ns)]
+
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return False
+        with open(self.index_path, 'rt') as f:
+            header = f.readline().rstrip("\n").split("\t")
+            if len(header) != 5 or header[0] != INDEX_VERSION or header[1:3] != self._fingerprint():
+                return False
+            self.traits = set(t for t in header[3].split(",") if t != "")
+            self.shared_ids = header[4] == "1"
+            for line in f:
+                spl = line.rstrip("\n").split("\t")
+                self.blocks.setdefault(spl[0], []).append([int(spl[1]), int(spl[2]), int(spl[3])])
+        return True
+
+
+    def _write(self):
+        header = [INDEX_VERSION] + self._fingerprint() + [",".join(sorted(self.traits)), "1" if self.shared_ids else "0"]
+        tmp_path = self.index_path+"."+str(os.getpid())
+        with open(tmp_path, 'wt') as out:
+            out.write("\t".join(header) + "\n")
+            for seqid, offset, lines, records in self._sortedBlocks(self.blocks.keys()):
+                out.write(f"{seqid}\t{offset}\t{lines}\t{records}\n")
+        os.replace(tmp_path, self.index_path)
+
+
+    def _iterateLines(self):
+        """Yields (offset, line) for all lines of the GFF file, with the lines as bytes."""
+        if not self.bgzf:
+            with open(self.gff_path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    yield offset, line
+                    offset += len(line)
+            return
+
+        reader = BGZFReader(self.gff_path)
+        partial = b""
+        partial_offset = None #virtual offset of a line that continues in the next block
+        for block_offset, data in reader.iterateBlocks():
+            pos = 0
+            while pos < len(data):
+                newline = data.find(b"\n", pos)
+                if newline == -1:
+                    if partial_offset is None:
+                        partial_offset = (block_offset << 16) | pos
+                    partial += data[pos:]
+                    break
+                if partial_offset is None:
+                    yield (block_offset << 16) | pos, data[pos:newline+1]
+                else:
+                    yield partial_offset, partial + data[pos:newline+1]
+                    partial = b""
+                    partial_offset = None
+                pos = newline+1
+        if partial_offset is not None:
+            yield partial_offset, partial
+        reader.close()
+
+
+    def _build(self):
+        print("Building GFF index:", self.gff_path)
+        trait_types = set(t.encode() for t in TRAIT_TYPES)
+        shared_id_finder = SharedIDFinder()
+        block = None
+        seqid = None
+        for offset, line in self._iterateLines():
+            if line.startswith(b"#"):
+                if block is not None:
+                    block[1] += 1
+                continue
+            spl = line.split(b"\t")
+            if spl[0] != seqid:
+                seqid = spl[0]
+                seqid_name = seqid.decode()
+                block = [offset, 0, 0]
+                self.blocks.setdefault(seqid_name, []).append(block)
+            block[1] += 1
+            block[2] += 1
+            if len(spl) > 2 and spl[2] in trait_types:
+                self.traits.add(spl[2].decode())
+            if len(spl) > 8:
+                shared_id_finder.addLine(seqid_name, spl[8].rstrip(b"\n").decode())
+        self.shared_ids = shared_id_finder.found
+
+
+    def _sortedBlocks(self, seqids):
+        """Returns (seqid, offset, lines, records) for all blocks of the given seqids, in the order of the file."""
+        blocks = [(seqid, b[0], b[1], b[2]) for seqid in seqids for b in self.blocks.get(seqid, [])]
+        blocks.sort(key=lambda b: b[1])
+        return blocks
+
+
+    def getSeqids(self):
+        """Returns the seqids in the order of their first appearance in the GFF file."""
+        return [b[0] for b in self._sortedBlocks(self.blocks.keys()) if self.blocks[b[0]][0][0] == b[1]]
+
+    def getRecordCount(self, seqid=None):
+        if seqid is not None:
+            return sum(b[2] for b in self.blocks.get(seqid, []))
+        return sum(b[2] for blocks in self.blocks.values() for b in blocks)
+
+    def applyTraits(self):
+        """Sets the information on what type of GFF file is present, just like GFFParser does while parsing."""
+        if "start_codon" in self.traits:
+            Parameters.gff_contains_startcodons = True
+        if "gene" in self.traits:
+            Parameters.gff_contains_genes = True
+        if "mRNA" in self.traits:
+            Parameters.gff_contains_transcripts = True
+
+
+    def readLines(self, seqids):
+        """Yields the lines of the given seqids in the order of the file, i.e. to be parsed by GFFParser(gff_path, lines=...)"""
+        if self.bgzf:
+            reader = BGZFReader(self.gff_path)
+        else:
+            reader = io.FileIO(self.gff_path, 'r')
+        try:
+            for _, offset, lines, _ in self._sortedBlocks(seqids):
+                if self.bgzf:
+                    reader.seekVirtual(offset)
+                else:
+                    reader.seek(offset)
+                #the buffers are created per block, since their content is invalid after seeking
+                text = io.TextIOWrapper(io.BufferedReader(reader))
+                for _ in range(lines):
+                    yield text.readline()
+                text.detach().detach()
+        finally:
+            reader.close()
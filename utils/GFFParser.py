@@ -6,201 +6,309 @@ from utils.DDBJWriter import DDBJWriter
 from utils.features import Feature, CompoundFeature, TruncatedLeftFeature, TruncatedRightFeature,\
     TruncatedBothSidesFeature
 from utils.Parameters import Parameters
+from utils.BGZFReader import openTextFile
+from utils.FeatureRegistry import FeatureRegistry
+import gc, sys
+
+
+class UnsortedGFFError(ValueError):
+    """Raised when a GFF file is expected to be sorted by seqid, but the lines of a seqid are not contiguous"""
+    pass
+
+
+class SharedIDFinder:
+    """Finds IDs that are used on more than one seqid, either as ID or as Parent.
+    The GFFParser resolves duplicate IDs and merges CDS with the same ID over the whole file, so the features of such
+    a file can't be parsed one contig at a time (--stream, or the workers reading their contigs via the GFFIndex)."""
+    
+    def __init__(self):
+        self.seqid_of_id = dict()
+        self.found = False
+    
+    def addLine(self, seqid, attribute_column):
+        if self.found:
+            return
+        for attribute in attribute_column.split(";"):
+            #the same attributes as in Feature.setRawAttributes
+            if attribute.startswith("ID=") or attribute.startswith("Parent="):
+                value = attribute.split("=")[1]
+                if self.seqid_of_id.setdefault(value, seqid) != seqid:
+                    self.found = True
+                    self.seqid_of_id = None #no longer needed
+                    return
 
     
     
 class GFFParser:
     
-    def __init__(self, gff_path):
+    def __init__(self, gff_path, lines=None):
         self.gff_path = gff_path
-        self.features = {} #contains all features
+        self.lines = lines #if provided, these lines are parsed instead of reading the file (see iterateContigs)
+        self.features = FeatureRegistry() #contains all features, indexed by type
         self.parentFeatures = [] #contains only features that have no parent themselves
+        self.id_counts = {} #number of times each ID was encountered, used to make duplicate IDs unique
+        self.derived_id_counts = {} #the same for the IDs derived from the parent of features without an ID
+        self.pending_children = {} #features whose parent has not been parsed (yet), grouped by the ID of the parent
     
-        self._parseGFF()
-        self._connectFeatures()
-        self._mergeCDSSequences()
-        self._detectIncompleteCDS()
-    
-    
-    def _preparseGFF(self, lines=1000):
-        """Reads the start of the GFF file to determine what type of GFF3 file is present"""
-        file_handle = None
-        if self.gff_path.lower().endswith(".gz"):
-            import gzip
-            file_handle = gzip.open(self.gff_path, 'rt')
-        else:
-            file_handle = open(self.gff_path, 'rt')
-        
-        for i, line in enumerate(file_handle):
-            if i>lines:
-                break
-            if "\tstart_codon\t" in line:
-                Parameters.gff_contains_startcodons = True
-            elif "\tgene\t" in line:
-                Parameters.gff_contains_genes = True
-            elif "\tmRNA\t" in line:
-                Parameters.gff_contains_transcripts = True
-            
-            #lets check if we already found all information we were looking for and stop if so
-            if Parameters.gff_contains_startcodons and Parameters.gff_contains_genes and Parameters.gff_contains_transcripts:
-                break
-            
-        file_handle.close()
+        #The feature graph consists of millions of objects, none of which become garbage while it is built.
+        #Pausing the garbage collector avoids repeatedly traversing the growing graph.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._parseGFF()
+            self._createPlaceholders()
+            self._mergeCDSSequences()
+            self._detectIncompleteCDS()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
     
     
     def _parseGFF(self):
-        """Iterates through a GFF file and extracts all features."""
-        
-        self._preparseGFF() #pre-parse the GFF to see what type of GFF file it is
+        """Iterates through a GFF file and extracts all features.
+        The type of GFF file (presence of start codons, genes and transcripts) is determined during the same pass, 
+        so that the file only needs to be read and decompressed once. Everything depending on these traits
+        is resolved after parsing (see _createPlaceholders and _detectIncompleteCDS)."""
         
-        file_handle = None
-        if self.gff_path.lower().endswith(".gz"):
-            import gzip
-            file_handle = gzip.open(self.gff_path, 'rt')
+        if self.lines is not None:
+            file_handle = self.lines
         else:
-            file_handle = open(self.gff_path, 'rt')
+            file_handle = openTextFile(self.gff_path)
         
-        for line in file_handle:
+        for line_number, line in enumerate(file_handle):
             if line.startswith("#"):
                 continue
             line = line.replace("\n", "")
             #print(line)
             spl = line.split("\t")
-            seqid=spl[0]
-            source=spl[1]
-            gfftype=spl[2]
+            #seqid, source and type are repeated on every line, interning lets all features share the same string object
+            seqid=sys.intern(spl[0])
+            source=sys.intern(spl[1])
+            gfftype=sys.intern(spl[2])
             start=int(spl[3])
             end=int(spl[4])
             score=spl[5]
             strand=spl[6]
             phase=spl[7]
-            attributes = spl[8].split(";")
+            
+            #collect the information on what type of GFF file is present
+            if gfftype == "start_codon":
+                Parameters.gff_contains_startcodons = True
+            elif gfftype == "gene":
+                Parameters.gff_contains_genes = True
+            elif gfftype == "mRNA":
+                Parameters.gff_contains_transcripts = True
             
             feature = Feature(seqid=seqid, source=source, gfftype=gfftype, start=start, end=end, score=score, strand=strand,phase=phase)
             
-            for attribute in attributes:
-                if "=" in attribute:
-                    attsplit = attribute.split("=")
-                    name = attsplit[0]
-                    value = attsplit[1]
-                    feature.addAttribute(name, value)
+            #only ID and Parent are needed right away, the remaining attributes are parsed on demand
+            feature.setRawAttributes(spl[8])
             
             
             #Some GFF files assign the same ID to all CDS fragments, spread over multiple lines, others use different ID's
             #Sometimes, the ID is even completely missing for child nodes
             #If the ID is already present, we can assign a new ID and later merge them via their shared parent
-            if feature.getAttribute("ID") is None:
-                if feature.getAttribute("Parent") is not None:
-                    feature.addAttribute("ID", feature.getAttribute("Parent")+"X")
-                pass
-            while feature.getAttribute("ID") in self.features.keys():
-                feature.attributes["ID"] = feature.attributes["ID"]+'X'
+            self._assignUniqueID(feature)
             self.features[feature.getAttribute("ID")] = feature
+            self._connectFeature(feature, line_number)
             
-        file_handle.close()
+        if self.lines is None:
+            file_handle.close()
+    
+    
+    @staticmethod
+    def scanGFF(gff_path):
+        """Reads the seqid and type columns and the IDs of a GFF file. The type of GFF file is determined just like in _parseGFF,
+        since it decides how the features of each contig are converted.
+        Returns the seqids in the order of their appearance, and whether IDs are shared between seqids (see SharedIDFinder).
+        Raises an UnsortedGFFError if the lines of a seqid are not contiguous."""
+        seqids = []
+        seen = set()
+        current = None
+        shared_id_finder = SharedIDFinder()
+        with openTextFile(gff_path) as file_handle:
+            for line in file_handle:
+                if line.startswith("#"):
+                    continue
+                spl = line.split("\t")
+                if spl[0] != current:
+                    current = spl[0]
+                    if current in seen:
+                        raise UnsortedGFFError(f"The GFF file is not sorted by seqid, the lines of {current} are not contiguous.")
+                    seen.add(current)
+                    seqids.append(current)
+                
+                gfftype = spl[2]
+                if gfftype == "start_codon":
+                    Parameters.gff_contains_startcodons = True
+                elif gfftype == "gene":
+                    Parameters.gff_contains_genes = True
+                elif gfftype == "mRNA":
+                    Parameters.gff_contains_transcripts = True
+                if len(spl) > 8:
+                    shared_id_finder.addLine(current, spl[8].rstrip("\n"))
+        return seqids, shared_id_finder.found
+    
+    
+    @staticmethod
+    def iterateContigs(gff_path):
+        """Yields (seqid, lines) for each contig of a GFF file that is sorted by seqid.
+        Only the lines of a single contig are kept in memory at a time."""
+        seqid = None
+        lines = []
+        with openTextFile(gff_path) as file_handle:
+            for line in file_handle:
+                if line.startswith("#"):
+                    continue
+                line_seqid = line.split("\t", 1)[0]
+                if line_seqid != seqid:
+                    if len(lines)>0:
+                        yield seqid, lines
+                    seqid = line_seqid
+                    lines = []
+                lines.append(line)
+        if len(lines)>0:
+            yield seqid, lines
+    
+    
+    def _assignUniqueID(self, feature):
+        """Makes the ID of a feature unique by attaching a numbered suffix (ID#1, ID#2, ...) if the ID was already used.
+        Features without an ID receive the ID of their parent with a suffix.
+        The number of collisions is counted per ID, so that resolving a duplicate does not require probing all previous suffixes.
+        IDs derived from the parent are counted separately, since a child may appear before its parent, which must then keep its ID.
+        If Parameters.legacy_duplicate_ids is set, the suffix consists of 'X' characters instead (ID, IDX, IDXX, ...)"""
+        base_id = feature.getAttribute("ID")
+        id_counts = self.id_counts
+        min_count = 0
+        if base_id is None:
+            base_id = feature.getAttribute("Parent")
+            if base_id is None:
+                return
+            id_counts = self.derived_id_counts
+            min_count = 1 #the parent itself already owns (or will own) the ID without suffix
         
+        count = max(id_counts.get(base_id, 0), min_count)
+        unique_id = self._buildDuplicateID(base_id, count)
+        while unique_id in self.features:
+            count += 1
+            unique_id = self._buildDuplicateID(base_id, count)
+        id_counts[base_id] = count+1
+        feature.addAttribute("ID", unique_id)
+    
+    
+    @staticmethod
+    def _buildDuplicateID(base_id, count):
+        if count == 0:
+            return base_id
+        if Parameters.legacy_duplicate_ids:
+            return base_id + "X"*count
+        return base_id + "#" + str(count)
         
-    def _connectFeatures(self):    
-        """Connects features that are in a parent/child relationship."""
         
-        placeholders = [] #a list of placeholder features, which we may need if some parent features are missing
+    def _connectFeature(self, feature, order):
+        """Connects a newly parsed feature to its parent and to all children that were parsed before the feature itself.
+        Children whose parent is not known yet are stored in pending_children. For these, the bounds of the children
+        are tracked while they arrive, so that a placeholder can be created for parents that never appear in the GFF file."""
+        feature_id = feature.getAttribute("ID")
         
-        keys = list(self.features.keys()) #save a copy because the size of the dict may change
+        #children that were waiting for this feature
+        pending = self.pending_children.pop(feature_id, None)
+        if pending is not None:
+            for _, child in pending["children"]:
+                feature.children.append(child)
+                child.parent = feature
         
-        for f_id in keys:
-            #print(f_id)
-            feature = self.features.get(f_id)
-            
-            parent_id = feature.getAttribute("Parent")
-            if parent_id is None:
-                self.parentFeatures.append(feature)
-            else:
-                #check if the parent exists
-                parent = self.features.get(parent_id)
-                if parent is not None:
-                    parent.children.append(feature)
-                    feature.parent = parent
+        parent_id = feature.getAttribute("Parent")
+        if parent_id is None:
+            self.parentFeatures.append(feature)
+            return
+        
+        parent = self.features.get(parent_id)
+        if parent is not None:
+            parent.children.append(feature)
+            feature.parent = parent
+            return
+        
+        pending = self.pending_children.get(parent_id)
+        if pending is None:
+            pending = {"children":[], "seqid":feature.seqid, "source":feature.source, "start":feature.start, "end":feature.end, "strand":feature.strand}
+            self.pending_children[parent_id] = pending
+        else:
+            pending["start"] = min(pending["start"], feature.start)
+            pending["end"] = max(pending["end"], feature.end)
+            strand = pending["strand"]
+            if (feature.strand == "+" or feature.strand == "-") and (strand != '+' and strand != "-"):
+                #if the child has + or - let's use that over a . entry
+                pending["strand"] = feature.strand
+        pending["children"].append((order, feature))
+    
+    
+    def _createPlaceholders(self):
+        """Some GFF files don't actually provide the parent of a feature. We'll have to create the parent in that case.
+        Since the type of placeholder depends on the type of GFF file, this is done once the whole file was parsed.
+        The location of the placeholder is obtained from the bounds of its children, which were collected during parsing."""
+        
+        #process the orphaned features in the order in which they appeared in the GFF file
+        orphans = []
+        for parent_id, pending in self.pending_children.items():
+            for order, child in pending["children"]:
+                orphans.append((order, parent_id, child))
+        orphans.sort(key=lambda x: x[0])
+        
+        for _, parent_id, feature in orphans:
+            #the placeholder may have been created for a previous child already
+            parent = self.features.get(parent_id)
+            if parent is not None:
+                parent.children.append(feature)
+                feature.parent = parent
+                
+            elif Parameters.gff_contains_transcripts and Parameters.gff_contains_genes == False:
+                #the gff file contains mRNAs, so the missing parent must belong be a gene
+                parent = Feature(gfftype="gene")
+                self._setPlaceholderLocation(parent, self.pending_children[parent_id])
+                parent.addAttribute("ID", parent_id)
+                self.features[parent_id] = parent
+                self.parentFeatures.append(parent)
+                parent.children.append(feature)
+                feature.parent = parent
+                
+            elif Parameters.gff_contains_transcripts == False and Parameters.gff_contains_genes == False:
+                #the gff file contains neither gene nor mRNA. We will need to create both
+                mRNA = Feature(gfftype="mRNA")
+                gene = Feature(gfftype="gene")
+                self._setPlaceholderLocation(mRNA, self.pending_children[parent_id])
+                self._setPlaceholderLocation(gene, self.pending_children[parent_id])
+                
+                mRNA.addAttribute("ID", parent_id)
+                mRNA.children.append(feature)
+                feature.parent = mRNA
+                
+                gene_id = None
+                if "." in parent_id:
+                    gene_id = parent_id.rsplit(".", maxsplit=1)[0]
                 else:
-                    #some GFF files, don't actually
-                    #provide the parent. We'll have to create the parent in that case
-                    #For now we'll make a placeholder feature. Once all features are connected, we can
-                    #calculate the start/end/strand etc from all the child nodes
-                    if Parameters.gff_contains_transcripts and Parameters.gff_contains_genes == False:
-                        #the gff file contains mRNAs, so the missing parent must belong be a gene
-                        parent = Feature(gfftype="gene")
-                        placeholders.append(parent)
-                        parent.addAttribute("ID", parent_id)
-                        self.features[parent_id] = parent
-                        self.parentFeatures.append(parent)
-                        parent.children.append(feature)
-                        feature.parent = parent
-                        
-                        
-                    elif Parameters.gff_contains_transcripts == False and Parameters.gff_contains_genes == False:
-                        #the gff file contains neither gene nor mRNA. We will need to create both
-                        mRNA = Feature(gfftype="mRNA")
-                        placeholders.append(mRNA)
-                        gene = Feature(gfftype="gene")
-                        placeholders.append(gene)
-                        
-                        mRNA.addAttribute("ID", parent_id)
-                        mRNA.children.append(feature)
-                        feature.parent = mRNA
-                        
-                        gene_id = None
-                        if "." in parent_id:
-                            gene_id = parent_id.rsplit(".", maxsplit=1)[0]
-                        else:
-                            gene_id = "gene_"+parent_id
-                        gene.addAttribute("ID", gene_id)
-                        gene.children.append(mRNA)
-                        mRNA.parent = gene
-                        self.parentFeatures.append(gene)
-                        
-                        self.features[gene.getAttribute("ID")] = gene
-                        self.features[mRNA.getAttribute("ID")] = mRNA
-                    
-                    
-        for placeholder in placeholders:
-            self._fixPlaceholder(placeholder)
+                    gene_id = "gene_"+parent_id
+                gene.addAttribute("ID", gene_id)
+                gene.children.append(mRNA)
+                mRNA.parent = gene
+                self.parentFeatures.append(gene)
+                
+                self.features[gene.getAttribute("ID")] = gene
+                self.features[mRNA.getAttribute("ID")] = mRNA
         
+        self.pending_children.clear()
     
-           
-    def _fixPlaceholder(self, placeholder_feature):
+    
+    def _setPlaceholderLocation(self, placeholder_feature, pending):
         """Placeholder features are features, that were created because the entries in the GFF
         file were referring to a parent, that was not written into the GFF file.
-        Using their child nodes, we can infer the required information.
+        Using the bounds of their child nodes, we can infer the required information.
         """
-        
-        child_start_positions = []
-        child_end_positions = []
-        strand = None
-        seqid = None
-        source = None
-        
-        for child in placeholder_feature.children:
-            #it's possible that the child is also a placeholder, whose attributes haven't been calculated yet!
-            if child.start is None:
-                self._fixPlaceholder(child)
-            child_start_positions.append(child.start)
-            child_end_positions.append(child.end)
-            
-            if seqid is None:
-                seqid = child.seqid
-            if source is None:
-                source = child.source
-                
-            if strand is None:
-                strand = child.strand
-            elif (child.strand == "+" or child.strand == "-") and (strand != '+' and strand != "-"):
-                #if the child has + or - let's use that over a . entry
-                strand = child.strand
-            
-        placeholder_feature.seqid = seqid
-        placeholder_feature.source = source
-        placeholder_feature.start = min(child_start_positions)
-        placeholder_feature.end = max(child_end_positions)
-        placeholder_feature.strand = strand
+        placeholder_feature.seqid = pending["seqid"]
+        placeholder_feature.source = pending["source"]
+        placeholder_feature.start = pending["start"]
+        placeholder_feature.end = pending["end"]
+        placeholder_feature.strand = pending["strand"]
         placeholder_feature.score = '.'
         placeholder_feature.phase = '.'
         
@@ -213,17 +321,19 @@ class GFFParser:
         keys_to_remove = set()
         entries_to_add = []
         
-        for key, feature in self.features.items():
-            if feature.gfftype == "mRNA":
-                cds_list = feature.getAllDownstreamCDS()
-                
-                if len(cds_list)>1:
-                    compound_feature = CompoundFeature(cds_list)
-                    entries_to_add.append((compound_feature.getAttribute("ID"), compound_feature))
-                    for cds in cds_list:
-                        feature.removeDownstreamChild(cds)
-                        keys_to_remove.add(cds.attributes["ID"])
-                    feature.children.append(compound_feature)
+        for key, feature in self.features.ofType("mRNA"):
+            cds_list = feature.getAllDownstreamCDS()
+            
+            if len(cds_list)>1:
+                #the CDS are a set, CDS with the same start are ordered by their ID, so that the first member (whose ID and seqid
+                #the compound feature takes) doesn't depend on the order of the set
+                cds_list = sorted(cds_list, key=lambda cds: (cds.start, cds.getAttribute("ID")))
+                compound_feature = CompoundFeature(cds_list)
+                entries_to_add.append((compound_feature.getAttribute("ID"), compound_feature))
+                for cds in cds_list:
+                    feature.removeDownstreamChild(cds)
+                    keys_to_remove.add(cds.getAttribute("ID"))
+                feature.children.append(compound_feature)
     
         for ktr in keys_to_remove:
             self.features.pop(ktr)
@@ -245,79 +355,77 @@ class GFFParser:
         
         to_replace=[]
         
-        for key, feature in self.features.items():
+        for key, feature in self.features.ofType("CDS"):
             has_startcodon = False
             has_stopcodon = False
             
-                
-            if feature.gfftype == 'CDS':
-                cds = feature
-                parent = feature.parent
-                if parent is None:
-                    continue
-                
-                startcodons = parent.getAllDownstreamOfType("start_codon")
-                if len(startcodons) > 0:
-                    has_startcodon = True
-                
-                stopcodons = parent.getAllDownstreamOfType("stop_codon")
-                if len(stopcodons) > 0:
-                    has_stopcodon = True
-                
-                if len(stopcodons)>1 or len(startcodons)>1:
-                    print("ERROR: Multiple start- or stopcodons found for CDS")
-                
-                if has_startcodon and has_stopcodon: #the CDS is fine, nothing to do here
-                    continue
-                
-                elif has_startcodon: #the end of the CDS is missing
+            cds = feature
+            parent = feature.parent
+            if parent is None:
+                continue
+            
+            startcodons = parent.getAllDownstreamOfType("start_codon")
+            if len(startcodons) > 0:
+                has_startcodon = True
+            
+            stopcodons = parent.getAllDownstreamOfType("stop_codon")
+            if len(stopcodons) > 0:
+                has_stopcodon = True
+            
+            if len(stopcodons)>1 or len(startcodons)>1:
+                print("ERROR: Multiple start- or stopcodons found for CDS")
+            
+            if has_startcodon and has_stopcodon: #the CDS is fine, nothing to do here
+                continue
+            
+            elif has_startcodon: #the end of the CDS is missing
 
-                    if cds.strand == "-":
-                        if isinstance(feature, CompoundFeature):
-                            #for compound features, we can simply replace the member inquestion
-                            cds.members[0] = TruncatedLeftFeature.cloneFeature(cds.members[0])
-                            cds._calculatePhase()
-                        else:
-                            #for regular features, we need to replace them by overwriting the entry in the features
-                            #dict later
-                            newfeature = TruncatedLeftFeature.cloneFeature(cds)
-                            to_replace.append((key, newfeature)) 
-                            
-                    else: #+strand
-                        if isinstance(feature, CompoundFeature):
-                            cds.members[-1] = TruncatedRightFeature.cloneFeature(cds.members[-1])
-                            cds._calculatePhase()
-                        else:
-                            newfeature = TruncatedRightFeature.cloneFeature(cds)
-                            to_replace.append((key, newfeature))
-                    
+                if cds.strand == "-":
+                    if isinstance(feature, CompoundFeature):
+                        #for compound features, we can simply replace the member inquestion
+                        cds.members[0] = TruncatedLeftFeature.cloneFeature(cds.members[0])
+                        cds._calculatePhase()
+                    else:
+                        #for regular features, we need to replace them by overwriting the entry in the features
+                        #dict later
+                        newfeature = TruncatedLeftFeature.cloneFeature(cds)
+                        to_replace.append((key, newfeature)) 
                         
-                elif has_stopcodon:
-                    
-                    if cds.strand == "-":
-                        if isinstance(feature, CompoundFeature):
-                            cds.members[-1] = TruncatedRightFeature.cloneFeature(cds.members[-1])
-                            cds._calculatePhase()
-                        else:
-                            newfeature = TruncatedRightFeature.cloneFeature(cds)
-                            to_replace.append((key, newfeature))
+                else: #+strand
+                    if isinstance(feature, CompoundFeature):
+                        cds.members[-1] = TruncatedRightFeature.cloneFeature(cds.members[-1])
+                        cds._calculatePhase()
                     else:
-                        if isinstance(feature, CompoundFeature):
-                            cds.members[0] = TruncatedLeftFeature.cloneFeature(cds.members[0])
-                            cds._calculatePhase()
-                        else:
-                            newfeature = TruncatedLeftFeature.cloneFeature(cds)
-                            to_replace.append((key, newfeature))
-                    
+                        newfeature = TruncatedRightFeature.cloneFeature(cds)
+                        to_replace.append((key, newfeature))
+                
                     
-                else: #the feature lacks both start and stopcodon
+            elif has_stopcodon:
+                
+                if cds.strand == "-":
                     if isinstance(feature, CompoundFeature):
-                        cds.members[0] = TruncatedLeftFeature.cloneFeature(cds.members[0])
                         cds.members[-1] = TruncatedRightFeature.cloneFeature(cds.members[-1])
+                        cds._calculatePhase()
+                    else:
+                        newfeature = TruncatedRightFeature.cloneFeature(cds)
+                        to_replace.append((key, newfeature))
+                else:
+                    if isinstance(feature, CompoundFeature):
+                        cds.members[0] = TruncatedLeftFeature.cloneFeature(cds.members[0])
+                        cds._calculatePhase()
                     else:
-                        newfeature = TruncatedBothSidesFeature.cloneFeature(cds)
+                        newfeature = TruncatedLeftFeature.cloneFeature(cds)
                         to_replace.append((key, newfeature))
                 
+                
+            else: #the feature lacks both start and stopcodon
+                if isinstance(feature, CompoundFeature):
+                    cds.members[0] = TruncatedLeftFeature.cloneFeature(cds.members[0])
+                    cds.members[-1] = TruncatedRightFeature.cloneFeature(cds.members[-1])
+                else:
+                    newfeature = TruncatedBothSidesFeature.cloneFeature(cds)
+                    to_replace.append((key, newfeature))
+            
         for key, newfeature in to_replace:
             oldfeature = self.features[key]
             if oldfeature.parent is not None:
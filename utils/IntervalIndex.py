@@ -0,0 +1,49 @@
+'''
+Indices for finding the features that overlap a range of a contig.
+The features are sorted by start once. A query finds its candidates with two binary searches: the features starting
+before the end of the range, and among them, the first one from which on the running maximum of the end positions reaches the range.
+'''
+import bisect
+from itertools import accumulate
+from utils.FeatureRegistry import typeList
+
+
+class IntervalIndex:
+    """A static index of features (or any objects with start and end, 1-based inclusive) of a single contig."""
+
+    def __init__(self, features):
+        self.features = sorted(features, key=lambda f: (f.start, f.end))
+        self.starts = [f.start for f in self.features]
+        self.max_ends = list(accumulate((f.end for f in self.features), max))
+
+    def __len__(self):
+        return len(self.features)
+
+    def overlapping(self, start, end):
+        """Returns the features that overlap start..end, sorted by their start."""
+        first = bisect.bisect_left(self.max_ends, start)
+        last = bisect.bisect_right(self.starts, end)
+        return [f for f in self.features[first:last] if f.end >= start]
+
+
+class FeatureIndex:
+    """IntervalIndices of features, separated by seqid and feature type."""
+
+    def __init__(self, features):
+        groups = dict()
+        for feature in features:
+            groups.setdefault((feature.seqid, feature.gfftype), []).append(feature)
+        self.indices = {key:IntervalIndex(group) for key, group in groups.items()}
+
+    def hasFeatures(self, seqid, gfftype):
+        return (seqid, gfftype) in self.indices
+
+    def overlapping(self, seqid, start, end, gfftypes):
+        """Returns the features of the given type(s) that overlap start..end of a contig.
+        The features of each type are sorted by their start."""
+        result = []
+        for gfftype in typeList(gfftypes):
+            index = self.indices.get((seqid, gfftype))
+            if index is not None:
+                result.extend(index.overlapping(start, end))
+        return result
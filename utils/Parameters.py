@@ -16,8 +16,21 @@ class Parameters:
         Parameters.gff_contains_genes = False
         Parameters.gff_contains_transcripts = False
         Parameters.export_all = False
+        Parameters.legacy_duplicate_ids = False
+        Parameters.min_gap_length = 1
         Parameters.keywords = []
     
+    @staticmethod
+    def getState():
+        """Returns a copy of all parameter values, i.e. to transfer them into worker processes."""
+        return {k:v for k, v in vars(Parameters).items() if not k.startswith("__") and not isinstance(v, staticmethod)}
+    
+    @staticmethod
+    def setState(state):
+        """Restores the parameter values obtained via getState()"""
+        for k, v in state.items():
+            setattr(Parameters, k, v)
+    
     @staticmethod
     def addCommonParam(feature_col, qualifier, value):
         feature_dict = Parameters.params.get(feature_col)
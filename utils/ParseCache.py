@@ -0,0 +1,141 @@
+'''
+An on-disk cache for the results of GFFParser and FastaParser. Conversions are often repeated with the same GFF and FASTA files,
+changing only the header or the command line parameters. With the cache, these files are only parsed once.
+
+Entries are pickled and stored in the cache directory. They are keyed by the path, size and modification time of the input file,
+by the parameters that influence parsing, and by the source code of the parsing modules and all utils modules they import
+(i.e. AssemblyGaps, FastaIndex and BGZFReader), so that entries of an older version are never used. The least recently used entries are removed once the cache exceeds its size limit.
+'''
+import gc, hashlib, os, pickle, re
+from utils.Parameters import Parameters
+
+CACHE_VERSION = "1"
+#modules whose code determines the content of the cache entries. The utils modules they import are included as well
+PARSER_MODULES = ("GFFParser.py", "FastaParser.py")
+IMPORT_PATTERN = re.compile(r"^\s*(?:from utils\.(\w+) import|from utils import ([\w, ]+)|import utils\.(\w+))", re.MULTILINE)
+
+
+class ParseCache:
+
+    def __init__(self, cache_dir, max_size_mb):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb*1024*1024
+        os.makedirs(cache_dir, exist_ok=True)
+        self.parser_version = ParseCache._parserVersion()
+
+
+    @staticmethod
+    def _parserModules(module_dir):
+        """Returns the parser modules and all utils modules they import, directly or indirectly, sorted by name."""
+        modules = set()
+        pending = list(PARSER_MODULES)
+        while len(pending)>0:
+            module = pending.pop()
+            if module in modules:
+                continue
+            modules.add(module)
+            with open(os.path.join(module_dir, module), 'rt') as f:
+                code = f.read()
+            for match in IMPORT_PATTERN.finditer(code):
+                names = match.group(1) or match.group(3) or match.group(2)
+                for name in names.split(","):
+                    name = name.strip()
+                    if os.path.exists(os.path.join(module_dir, name+".py")):
+                        pending.append(name+".py")
+        return sorted(modules)
+
+
+    @staticmethod
+    def _parserVersion():
+        h = hashlib.sha1(CACHE_VERSION.encode())
+        module_dir = os.path.dirname(os.path.abspath(__file__))
+        for module in ParseCache._parserModules(module_dir):
+            h.update(module.encode())
+            with open(os.path.join(module_dir, module), 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+
+    def _entryPath(self, kind, path, *extra):
+        stat = os.stat(path)
+        key = [kind, self.parser_version, os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns)]
+        key.extend(str(e) for e in extra)
+        name = hashlib.sha1("\t".join(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, kind+"_"+name+".pickle")
+
+
+    def _load(self, entry_path):
+        if not os.path.exists(entry_path):
+            return None
+        #like during parsing, the garbage collector would repeatedly traverse the growing feature graph
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(entry_path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            print("Warning: Ignoring unreadable cache entry", entry_path)
+            return None
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        #the modification time marks the entry as recently used
+        os.utime(entry_path)
+        return data
+
+
+    def _store(self, entry_path, data):
+        tmp_path = entry_path+".tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            print("Warning: Could not write the cache entry", entry_path)
+            return
+        self._evict()
+
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache fits into its size limit."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pickle"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        for _, size, name in entries:
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+
+    def loadFeatures(self, gff_path):
+        """Returns the features parsed from the GFF file, or None if they are not cached.
+        The information on what type of GFF file is present is restored as well."""
+        data = self._load(self._entryPath("gff", gff_path, Parameters.legacy_duplicate_ids))
+        if data is None:
+            return None
+        features, traits = data
+        Parameters.gff_contains_startcodons = traits[0]
+        Parameters.gff_contains_genes = traits[1]
+        Parameters.gff_contains_transcripts = traits[2]
+        return features
+
+    def storeFeatures(self, gff_path, features):
+        """Stores the features of a GFF file. Must be called before the features are converted."""
+        traits = (Parameters.gff_contains_startcodons, Parameters.gff_contains_genes, Parameters.gff_contains_transcripts)
+        self._store(self._entryPath("gff", gff_path, Parameters.legacy_duplicate_ids), (features, traits))
+
+
+    def loadFastaParser(self, fasta_path):
+        """Returns the FastaParser of the FASTA file, with the sequence lengths and assembly gaps, or None if it is not cached."""
+        fastaParser = self._load(self._entryPath("fasta", fasta_path))
+        if fastaParser is not None:
+            fastaParser.registerSequenceLengths()
+        return fastaParser
+
+    def storeFastaParser(self, fasta_path, fastaParser):
+        self._store(self._entryPath("fasta", fasta_path), fastaParser)
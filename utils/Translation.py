@@ -0,0 +1,69 @@
+'''
+Translation of coding sequences with the genetic codes of the NCBI (https://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi),
+which are the values allowed for the transl_table qualifier.
+Each code is given as the amino acids of the 64 codons, in the order TTT, TTC, TTA, TTG, TCT, ... GGG.
+The lookup table of a code is only built once it is needed.
+'''
+
+BASES = "TCAG"
+
+GENETIC_CODES = {
+    1:  "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Standard
+    2:  "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG", #Vertebrate Mitochondrial
+    3:  "FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Yeast Mitochondrial
+    4:  "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Mold, Protozoan, Coelenterate Mitochondrial and Mycoplasma
+    5:  "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG", #Invertebrate Mitochondrial
+    6:  "FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Ciliate, Dasycladacean and Hexamita Nuclear
+    9:  "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG", #Echinoderm and Flatworm Mitochondrial
+    10: "FFLLSSSSYY**CCCWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Euplotid Nuclear
+    11: "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Bacterial, Archaeal and Plant Plastid
+    12: "FFLLSSSSYY**CC*WLLLSPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Alternative Yeast Nuclear
+    13: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSGGVVVVAAAADDEEGGGG", #Ascidian Mitochondrial
+    14: "FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG", #Alternative Flatworm Mitochondrial
+    15: "FFLLSSSSYY*QCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Blepharisma Nuclear
+    16: "FFLLSSSSYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Chlorophycean Mitochondrial
+    21: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNNKSSSSVVVVAAAADDEEGGGG", #Trematode Mitochondrial
+    22: "FFLLSS*SYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Scenedesmus obliquus Mitochondrial
+    23: "FF*LSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Thraustochytrium Mitochondrial
+    24: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG", #Rhabdopleuridae Mitochondrial
+    25: "FFLLSSSSYY**CCGWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Candidate Division SR1 and Gracilibacteria
+    26: "FFLLSSSSYY**CC*WLLLAPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Pachysolen tannophilus Nuclear
+    27: "FFLLSSSSYYQQCCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Karyorelict Nuclear
+    28: "FFLLSSSSYYQQCCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Condylostoma Nuclear
+    29: "FFLLSSSSYYYYCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Mesodinium Nuclear
+    30: "FFLLSSSSYYEECC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Peritrich Nuclear
+    31: "FFLLSSSSYYEECCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Blastocrithidia Nuclear
+    32: "FFLLSSSSYY*WCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG", #Balanophoraceae Plastid
+    33: "FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG", #Cephalodiscidae Mitochondrial
+}
+
+#amino acid for codons that contain other characters than A, C, G and T (i.e. N)
+UNKNOWN_AMINO_ACID = "X"
+
+_codon_tables = dict()
+
+
+def getCodonTable(transl_table):
+    """Returns a dict that maps the 64 codons to the amino acids of a genetic code (given by its transl_table number).
+    Raises a ValueError for unknown genetic codes."""
+    transl_table = int(transl_table)
+    table = _codon_tables.get(transl_table)
+    if table is None:
+        amino_acids = GENETIC_CODES.get(transl_table)
+        if amino_acids is None:
+            raise ValueError(f"Unknown genetic code (transl_table): {transl_table}")
+        codons = [b1+b2+b3 for b1 in BASES for b2 in BASES for b3 in BASES]
+        table = dict(zip(codons, amino_acids))
+        _codon_tables[transl_table] = table
+    return table
+
+
+def translate(dna_seq, transl_table=1):
+    """Translates an (upper case) DNA sequence, starting at its first base. An incomplete last codon is ignored."""
+    lookup = getCodonTable(transl_table).get
+    return "".join([lookup(dna_seq[i:i+3], UNKNOWN_AMINO_ACID) for i in range(0, len(dna_seq)-2, 3)])
+
+
+def translateBatch(dna_sequences, transl_tables):
+    """Translates many sequences, each with its own genetic code. Returns the proteins in the order of the sequences."""
+    return [translate(dna_seq, transl_table) for dna_seq, transl_table in zip(dna_sequences, transl_tables)]
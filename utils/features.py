@@ -1,7 +1,12 @@
-import copy
+import copy, operator, sys
 """The Feature class stores all required information for features, including their relationships."""  
 
 class Feature:
+    #Large GFF files contain millions of features. Using __slots__ avoids a per-instance __dict__
+    __slots__ = ("_seqid", "_source", "_gfftype", "_start", "_end", "score", "_strand", "phase", "_attributes", "_raw_attributes", "parent", "children", "_structural_key")
+    
+    #attributes that are extracted immediately when the attributes are set via setRawAttributes
+    EAGER_ATTRIBUTES = ("ID", "Parent")
   
     def __init__(self, seqid="", source="", gfftype="", start=None, end=None, score=None, strand="", phase="", attribute_dict=None):
         self.seqid = seqid
@@ -19,6 +24,84 @@ class Feature:
         self.parent = None #reference to the parent feature object
         self.children = [] #list of feature objects belonging to this feature
     
+    
+    def _keyField(name):
+        """A property for a field that is part of the structural key. Assigning the field drops the cached key (see getStructuralKey)."""
+        slot = "_"+name
+        getter = operator.attrgetter(slot)
+        def setter(self, value):
+            setattr(self, slot, value)
+            self._structural_key = None
+        return property(getter, setter)
+    
+    seqid = _keyField("seqid")
+    source = _keyField("source")
+    gfftype = _keyField("gfftype")
+    start = _keyField("start")
+    end = _keyField("end")
+    strand = _keyField("strand")
+    
+    
+    def __getstate__(self):
+        #pickling (i.e. for the parse cache) stores the slot values as a tuple, which is faster and more compact than the default dict of slots
+        return tuple(getattr(self, slot) for slot in self._allSlots())
+    
+    def __setstate__(self, state):
+        for slot, value in zip(self._allSlots(), state):
+            setattr(self, slot, value)
+    
+    @classmethod
+    def _allSlots(cls):
+        slots = cls.__dict__.get("_all_slots")
+        if slots is None:
+            slots = tuple(slot for c in reversed(cls.__mro__) for slot in c.__dict__.get("__slots__", ()))
+            setattr(cls, "_all_slots", slots)
+        return slots
+    
+    
+    @property
+    def attributes(self):
+        if self._raw_attributes is not None:
+            self._parseRawAttributes()
+        #the caller may change the returned dict
+        self._structural_key = None
+        return self._attributes
+    
+    @attributes.setter
+    def attributes(self, attribute_dict):
+        self._attributes = attribute_dict
+        self._raw_attributes = None
+        self._structural_key = None
+    
+    
+    def setRawAttributes(self, raw_attributes):
+        """Stores the unparsed attribute column of a GFF line. Only ID and Parent are extracted right away,
+        all other attributes are parsed when the attributes are first accessed.
+        Most attributes of most GFF lines never make it into the annotation file."""
+        self._attributes = dict()
+        has_other_attributes = False
+        for attribute in raw_attributes.split(";"):
+            if attribute.startswith("ID=") or attribute.startswith("Parent="):
+                attsplit = attribute.split("=")
+                self._attributes[sys.intern(attsplit[0])] = attsplit[1]
+            elif "=" in attribute:
+                has_other_attributes = True
+        #the raw string is only kept if it contains more than ID and Parent, which is not the case for most exons, introns and CDS
+        self._raw_attributes = raw_attributes if has_other_attributes else None
+    
+    
+    def _parseRawAttributes(self):
+        parsed = dict()
+        for attribute in self._raw_attributes.split(";"):
+            if "=" in attribute:
+                attsplit = attribute.split("=")
+                parsed[sys.intern(attsplit[0])] = attsplit[1]
+        #the eagerly parsed attributes may have been changed in the meantime (i.e. to make the ID unique)
+        for name, value in self._attributes.items():
+            parsed[name] = value
+        self._attributes = parsed
+        self._raw_attributes = None
+    
     def buildLocationString(self):
         """Uses the start/end/strand values to build a location string"""
         if self.start == self.end:
@@ -48,9 +131,15 @@ class Feature:
         return [left, right]
     
     def addAttribute(self, name, value):
-        self.attributes[name] = str(value)
+        if self._raw_attributes is not None and name in Feature.EAGER_ATTRIBUTES:
+            self._attributes[name] = str(value)
+            self._structural_key = None
+        else:
+            self.attributes[name] = str(value)
     
     def getAttribute(self, name):
+        if self._raw_attributes is not None and name in Feature.EAGER_ATTRIBUTES:
+            return self._attributes.get(name)
         return self.attributes.get(name)
     
     def hasAttribute(self, name, case_sensitive=False):
@@ -126,18 +215,37 @@ class Feature:
             h+="_"+str(qualifier)+"_"+str(value)
         return h
     
+    def getStructuralKey(self):
+        """Same content as getHash, but as a tuple, which is cheaper to build and compare than the concatenated string.
+        The key is computed once and kept until the location, type or attributes of the feature are changed."""
+        key = self._structural_key
+        if key is not None:
+            return key
+        if self._raw_attributes is not None:
+            self._parseRawAttributes()
+        #a single flat tuple (the qualifier names, followed by their values), since millions of nested tuples keep the garbage collector busy
+        attributes = self._attributes
+        qualifiers = sorted(attributes)
+        key = [self.seqid, self.source, self.gfftype, self.buildLocationString(), self.strand]
+        key.extend(qualifiers)
+        key.extend([str(attributes[q]) for q in qualifiers])
+        key = tuple(key)
+        self._structural_key = key
+        return key
+    
     def removeDuplicateChildren(self):
-        children_to_remove = []
-        child_hashes = set()
+        """Removes children with the same content as a preceding child, in a single pass over the children."""
+        if len(self.children)<2:
+            return
+        child_keys = set()
+        unique_children = []
         for child in self.children:
-            h = child.getHash()
-            
-            if h in child_hashes:
-                children_to_remove.append(child)
-            else:
-                child_hashes.add(h)
-        for ctr in children_to_remove:
-            self.children.remove(ctr)
+            key = child.getStructuralKey()
+            if key not in child_keys:
+                child_keys.add(key)
+                unique_children.append(child)
+        if len(unique_children) < len(self.children):
+            self.children = unique_children
         
     
     
@@ -162,6 +270,9 @@ class Feature:
     
     
 class CompoundFeature(Feature):
+    __slots__ = ("_members",)
+    
+    members = Feature._keyField("members")
 
     def __init__(self, members):
         self.members = list(members)
@@ -258,21 +369,34 @@ class CompoundFeature(Feature):
             elif member.start>splitend:
                 right_members.append(member)
             else:
-                splitmember = member.split(splitstart, splitend)
-                left_members.append(splitmember[0])
-                right_members.append(splitmember[1])
+                left_piece, right_piece = member.split(splitstart, splitend)
+                #a gap that starts or ends at the boundary of a member (or covers the whole member) leaves empty pieces, which are dropped
+                if left_piece.start <= left_piece.end:
+                    left_members.append(left_piece)
+                if right_piece.start <= right_piece.end:
+                    right_members.append(right_piece)
+        
+        #the members next to the gap are truncated towards the gap, even if nothing was left of the member that overlapped the gap.
+        #A split at the outer end of a member returns a truncated copy of the whole member
+        if len(left_members)>0 and not isinstance(left_members[-1], (TruncatedRightFeature, TruncatedBothSidesFeature)):
+            last = left_members[-1]
+            left_members[-1] = last.split(last.end+1, last.end)[0]
+        if len(right_members)>0 and not isinstance(right_members[0], (TruncatedLeftFeature, TruncatedBothSidesFeature)):
+            first = right_members[0]
+            right_members[0] = first.split(first.start, first.start-1)[1]
         
         left = self.clone()
         left.members = left_members
         right = self.clone()
         right.members = right_members
-        left.end = splitstart-1
-        right.start = splitend+1
+        #a piece without members is empty (end < start), see FeatureConverter._splitFeaturesWithGaps
+        left.end = left_members[-1].end if len(left_members)>0 else splitstart-1
+        right.start = right_members[0].start if len(right_members)>0 else splitend+1
         
-        left._calculatePhase()
-        left.attributes["codon_start"] = str(int(left.phase)+1)
-        right._calculatePhase()
-        right.attributes["codon_start"] = str(int(right.phase)+1)
+        for piece in (left, right):
+            if len(piece.members)>0:
+                piece._calculatePhase()
+                piece.attributes["codon_start"] = str(int(piece.phase)+1)
         return [left, right]
     
     def containsTruncatedMember(self):
@@ -284,6 +408,7 @@ class CompoundFeature(Feature):
     
 class TruncatedFeature(Feature):
     """An empty class, serving as interface for all features that are truncated."""
+    __slots__ = ()
     def __init__(self, seqid="", source="", gfftype="", start=None, end=None, score=None, strand="", phase="", attribute_dict=None):
         Feature.__init__(self, seqid=seqid, source=source, gfftype=gfftype, start=start, end=end, score=score, strand=strand, phase=phase, attribute_dict=attribute_dict)
     
@@ -291,6 +416,7 @@ class TruncatedFeature(Feature):
     
 """A special feature that, where the actual start position is smaller than the provided start position"""
 class TruncatedLeftFeature(TruncatedFeature):
+    __slots__ = ()
     
     @staticmethod
     def cloneFeature(basefeature):
@@ -372,6 +498,7 @@ class TruncatedLeftFeature(TruncatedFeature):
 
 
 class TruncatedRightFeature(TruncatedFeature):
+    __slots__ = ()
  
     @staticmethod
     def cloneFeature(basefeature):
@@ -451,6 +578,7 @@ class TruncatedRightFeature(TruncatedFeature):
     
     
 class TruncatedBothSidesFeature(TruncatedFeature):
+    __slots__ = ()
  
     @staticmethod
     def cloneFeature(basefeature):